@@ -1,48 +1,147 @@
 # -*- coding: utf-8 -*-
 
+import os
+
 from flask import Flask
 from flask.ext.login import LoginManager
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event
 
 from . import filters
-from .models import db, User, Project
+from .assets import assets
+from .cache import page_cache, fragment_cache
+from .compression import compressor
+from .fragments import FragmentCacheExtension
+from .freeze import freezer
+from .jobs import job_queue
+from .metrics import metrics
+from .mirror import mirror
+from .models import (db, UserSnapshot, AnonymousUser, nav_cache, user_cache,
+                     project_choices)
+from .passwords import passwords
 from .views import module
 
-__all__ = ('create_app',)
+__all__ = ('create_app', 'precompile_templates')
+
+
+_POOL_OPTIONS = ('SQLALCHEMY_POOL_SIZE', 'SQLALCHEMY_POOL_TIMEOUT',
+                 'SQLALCHEMY_POOL_RECYCLE')
 
 
-def _get_projects():
-    return Project.query.with_entities(Project.short_name, Project.name).all()
+def _set_sqlite_pragmas(pragmas):
+    def on_connect(connection, record):
+        cursor = connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+        cursor.close()
+    return on_connect
 
 
 def _init_db(app, create_db):
+    is_sqlite = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+    if is_sqlite:
+        # SQLite connections are not pooled.
+        for option in _POOL_OPTIONS:
+            app.config.pop(option, None)
+
     db.app = app
     db.init_app(app)
+
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    if is_sqlite and pragmas:
+        event.listen(db.get_engine(app), 'connect',
+                     _set_sqlite_pragmas(pragmas))
+
     if create_db:
         db.create_all()
 
 
+def _init_freezer(app):
+    freezer.init_app(app)
+
+
+def _init_jobs(app):
+    job_queue.init_app(app)
+
+
+def _init_mirror(app):
+    mirror.init_app(app)
+
+
+def _init_metrics(app):
+    metrics.init_app(app, db.get_engine(app))
+
+
+def _init_cache(app):
+    page_cache.init_app(app)
+    fragment_cache.init_app(app)
+    nav_cache.ttl = project_choices.ttl = app.config.get('NAV_CACHE_TTL', 10)
+
+
+def _init_compressor(app):
+    compressor.init_app(app)
+
+
 def _init_jinja(app):
     filters.init_app(app)
-    app.jinja_env.globals['get_projects'] = _get_projects
+    assets.init_app(app)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.globals['get_projects'] = nav_cache.get
+
+    if app.config.get('TEMPLATE_BYTECODE_CACHE', True):
+        path = app.config.get('TEMPLATE_BYTECODE_CACHE_DIR')
+        if path is None:
+            path = os.path.join(app.instance_path, 'template_bytecode_cache')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(path)
+
+
+def precompile_templates(app):
+    '''Compiles every template into the bytecode cache, so new workers load
+    them instead of compiling them on first use. Returns their names.'''
+    env = app.jinja_env
+    names = list(env.list_templates(extensions=['html']))
+    for name in names:
+        env.get_template(name)
+    return names
 
 
 def _init_login(app):
+    passwords.init_app(app)
+
     login_manager = LoginManager()
     login_manager.init_app(app)
-    login_manager.user_loader(User.get)
+    login_manager.user_loader(UserSnapshot.get)
+    login_manager.anonymous_user = AnonymousUser
+    user_cache.ttl = app.config.get('USER_CACHE_TTL', 10)
+    user_cache.max_items = app.config.get('USER_CACHE_SIZE', 10000)
     login_manager.login_view = "/signin"
 
 
-def create_app(name=None, create_db=False):
+def create_app(name=None, create_db=False, config=None, profile=None):
     if name is None:
         name = __name__
+    if profile is None:
+        profile = os.environ.get('APP_PROFILE', 'development')
 
     app = Flask(name)
-    app.config.from_object('config')
+    app.config.from_object('config.{0}Config'.format(profile.title()))
+    if config is not None:
+        app.config.update(config)
+    for key in ('SECRET_KEY', 'WTF_CSRF_SECRET_KEY'):
+        if not app.config.get(key):
+            raise RuntimeError('{0} is not set.'.format(key))
 
     _init_db(app, create_db)
+    _init_metrics(app)
+    _init_cache(app)
     _init_jinja(app)
     _init_login(app)
+    _init_freezer(app)
+    _init_jobs(app)
+    _init_mirror(app)
+    _init_compressor(app)
 
     app.register_blueprint(module)
     return app
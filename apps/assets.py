@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ('Assets', 'build_assets', 'assets')
+
+# Built files go to this subfolder of the static folder, so unbuilt files
+# keep working through the plain static route.
+BUILD_DIR = 'dist'
+
+MANIFEST_NAME = 'manifest.json'
+
+# Fingerprinted names never change content, so browsers may keep them.
+_IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_COMPRESSED_TYPES = ('.css', '.js', '.svg', '.ttf', '.eot', '.json', '.txt')
+
+_CSS_URL_PATTERN = re.compile(r'''url\((['"]?)([^'")]+)\1\)''')
+
+# Content-Encoding and file suffix, in order of preference.
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _fingerprint(path, content):
+    digest = hashlib.sha1(content).hexdigest()[:12]
+    root, ext = posixpath.splitext(path)
+    return '{0}.{1}{2}'.format(root, digest, ext)
+
+
+def _source_files(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder and BUILD_DIR in dirs:
+            dirs.remove(BUILD_DIR)
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), static_folder)
+            yield path.replace(os.sep, '/')
+
+
+def _rewrite_css(path, content, manifest):
+    # Points url() references at the fingerprinted names, keeping any
+    # query or fragment (e.g. the ``?#iefix`` of webfont declarations).
+    css_dir = posixpath.dirname(path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if re.match(r'^(data:|[a-z]+:|//|#)', url):
+            return match.group(0)
+
+        target = re.split(r'[?#]', url, 1)[0]
+        suffix = url[len(target):]
+        resolved = posixpath.normpath(posixpath.join(css_dir, target))
+        if resolved not in manifest:
+            return match.group(0)
+
+        hashed = posixpath.relpath(manifest[resolved], css_dir)
+        return 'url({0}{1}{2}{0})'.format(quote, hashed, suffix)
+
+    return _CSS_URL_PATTERN.sub(replace, content.decode('utf-8')) \
+        .encode('utf-8')
+
+
+def _write(filename, content):
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with io.open(filename, 'wb') as f:
+        f.write(content)
+
+
+def _gzip(content):
+    buf = io.BytesIO()
+    # A fixed mtime keeps rebuilds of the same content byte-identical.
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0) as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+def build_assets(static_folder, clean=False):
+    '''Writes fingerprinted copies of the static files, with ``.gz`` and,
+    if the ``brotli`` module is installed, ``.br`` siblings, and a manifest
+    mapping each original name to its copy.
+
+    Copies from earlier builds are kept unless ``clean`` is set, so pages
+    cached before a rebuild still find their files. Returns a dict of
+    byte totals.
+    '''
+    build_folder = os.path.join(static_folder, BUILD_DIR)
+    sources = sorted(_source_files(static_folder))
+    # CSS goes last, once the names of the files it refers to are known.
+    sources.sort(key=lambda path: path.endswith('.css'))
+
+    manifest = {}
+    totals = {'files': 0, 'bytes': 0, 'gzip_bytes': 0, 'br_bytes': 0}
+    for path in sources:
+        with io.open(os.path.join(static_folder, path), 'rb') as f:
+            content = f.read()
+        if path.endswith('.css'):
+            content = _rewrite_css(path, content, manifest)
+
+        hashed = manifest[path] = _fingerprint(path, content)
+        filename = os.path.join(build_folder, hashed)
+        _write(filename, content)
+        totals['files'] += 1
+        totals['bytes'] += len(content)
+
+        variants = {}
+        if path.endswith(_COMPRESSED_TYPES):
+            variants['.gz'] = _gzip(content)
+            if brotli is not None:
+                variants['.br'] = brotli.compress(content)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(content):
+                _write(filename + suffix, compressed)
+        totals['gzip_bytes'] += len(variants.get('.gz', content))
+        totals['br_bytes'] += len(variants.get('.br', variants.get(
+            '.gz', content)))
+
+    if clean:
+        _remove_stale(build_folder, manifest)
+    _write(os.path.join(build_folder, MANIFEST_NAME),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return totals
+
+
+def _remove_stale(build_folder, manifest):
+    keep = set(manifest.values())
+    for path in list(_source_files(build_folder)):
+        original = path
+        for _, suffix in _ENCODINGS:
+            if path.endswith(suffix):
+                original = path[:-len(suffix)]
+        if original not in keep:
+            os.remove(os.path.join(build_folder, path))
+
+
+class Assets(object):
+    '''Points ``url_for('static', ...)`` at fingerprinted copies listed in
+    the manifest written by ``manage.py assets`` and serves them, or their
+    precompressed siblings, with an immutable ``Cache-Control``.
+
+    Without a manifest, static files are served as before. Workers load
+    the manifest when they start, so restart them after a build.
+    '''
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.build_folder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.manifest = {}
+        # Pages load jQuery from JQUERY_URL until a copy is vendored.
+        app.jinja_env.globals['jquery_vendored'] = os.path.isfile(
+            os.path.join(app.static_folder, 'js', 'jquery.min.js'))
+        if not app.config.get('STATIC_ASSETS', True):
+            return
+
+        self.build_folder = os.path.join(app.static_folder, BUILD_DIR)
+        filename = os.path.join(self.build_folder, MANIFEST_NAME)
+        if not os.path.exists(filename):
+            return
+
+        with io.open(filename, 'rb') as f:
+            self.manifest = json.loads(f.read().decode('utf-8'))
+        app.url_defaults(self._url_defaults)
+        app.add_url_rule(
+            '{0}/{1}/<path:filename>'.format(app.static_url_path, BUILD_DIR),
+            'assets', self.send)
+
+    def _url_defaults(self, endpoint, values):
+        if endpoint == 'static':
+            hashed = self.manifest.get(values.get('filename'))
+            if hashed is not None:
+                values['filename'] = posixpath.join(BUILD_DIR, hashed)
+
+    def send(self, filename):
+        mimetype = mimetypes.guess_type(filename)[0]
+        accepted = request.accept_encodings
+        encoding = None
+        for name, suffix in _ENCODINGS:
+            if accepted[name] and os.path.isfile(
+                    os.path.join(self.build_folder, filename + suffix)):
+                encoding = name
+                filename += suffix
+                break
+
+        response = send_from_directory(self.build_folder, filename,
+                                       mimetype=mimetype)
+        response.headers['Cache-Control'] = _IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.content_encoding = encoding
+        return response
+
+
+assets = Assets()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = ('PageCache', 'MemoryBackend', 'FileBackend', 'NullBackend',
+           'VersionedValue', 'TTLCache', 'page_cache', 'fragment_cache')
+
+
+class NullBackend(object):
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend(object):
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class FileBackend(object):
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _filename(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name + '.cache')
+
+    def _entries(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.cache'):
+                filename = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, filename
+
+    def _prune(self):
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, filename in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            size -= entry_size
+
+    def get(self, key):
+        filename = self._filename(key)
+        try:
+            with io.open(filename, 'rb') as f:
+                value = f.read()
+            os.utime(filename, None)
+        except (IOError, OSError):
+            return None
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        filename = self._filename(key)
+        tmp_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with self._lock:
+            with io.open(tmp_filename, 'wb') as f:
+                f.write(value)
+            os.rename(tmp_filename, filename)
+            self._prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for _, _, filename in list(self._entries()):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+
+class PageCache(object):
+    '''Caches rendered pages as UTF-8 bytes, tagged with a version stamp.
+
+    An entry is only returned if its stamp matches the one the caller
+    expects, so bumping the stamp (e.g. ``Project.update_date``) is enough
+    to invalidate it even in other worker processes.
+
+    Other representations of a page, e.g. its compressed bodies, are kept
+    as ``variant`` entries next to it under the same stamp.
+
+    Settings are read from ``<config_prefix>_TYPE``, ``_SIZE`` and ``_DIR``.
+    '''
+
+    def __init__(self, app=None, config_prefix='PAGE_CACHE'):
+        self.config_prefix = config_prefix
+        self.backend = NullBackend()
+        self.variants = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        cache_type = app.config.get(prefix + '_TYPE', 'memory')
+        max_bytes = app.config.get(prefix + '_SIZE', 16 * 1024 * 1024)
+        if cache_type == 'memory':
+            self.backend = MemoryBackend(max_bytes)
+        elif cache_type == 'file':
+            path = app.config.get(prefix + '_DIR')
+            if path is None:
+                path = os.path.join(app.instance_path, prefix.lower())
+            self.backend = FileBackend(path, max_bytes)
+        else:
+            self.backend = NullBackend()
+
+    def _key(self, key, variant):
+        if variant is None:
+            return key
+        return '{0}#{1}'.format(key, variant)
+
+    def get(self, key, version, variant=None):
+        value = self.backend.get(self._key(key, variant))
+        if value is None:
+            return None
+
+        stamp, _, body = value.partition(b'\n')
+        if stamp != version.encode('utf-8'):
+            return None
+        return body
+
+    def set(self, key, version, body, variant=None):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        if variant is not None:
+            self.variants.add(variant)
+        self.backend.set(self._key(key, variant),
+                         version.encode('utf-8') + b'\n' + body)
+        return body
+
+    def delete(self, key):
+        self.backend.delete(key)
+        for variant in list(self.variants):
+            self.backend.delete(self._key(key, variant))
+
+    def clear(self):
+        self.backend.clear()
+
+
+class VersionedValue(object):
+    '''Keeps a process-local copy of a value loaded from the database.
+
+    The copy is trusted for ``ttl`` seconds; after that the shared version
+    counter is read and the value is only reloaded if the counter changed.
+    '''
+
+    def __init__(self, load, get_version, ttl=10):
+        self.load = load
+        self.get_version = get_version
+        self.ttl = ttl
+        self.version = None
+        self._value = None
+        self._expires = 0
+
+    def get(self):
+        now = time.time()
+        if now < self._expires:
+            return self._value
+
+        version = self.get_version()
+        if version != self.version:
+            self._value = self.load()
+            self.version = version
+        self._expires = now + self.ttl
+        return self._value
+
+    def invalidate(self):
+        self.version = None
+        self._expires = 0
+
+
+class TTLCache(object):
+    '''Keeps values in process memory for ``ttl`` seconds, and at most
+    ``max_items`` of them.'''
+
+    def __init__(self, ttl=10, max_items=10000):
+        self.ttl = ttl
+        self.max_items = max_items
+        # Ordered by expiry, since every item lives for ``ttl`` seconds.
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        while self._items:
+            key, (expires, _) = next(iter(self._items.items()))
+            if expires >= now and len(self._items) <= self.max_items:
+                break
+            del self._items[key]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < now:
+                del self._items[key]
+                return None
+            return item[1]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (now + self.ttl, value)
+            self._prune(now)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+page_cache = PageCache()
+
+# Parts of pages shared by every viewer, e.g. the sections of a project.
+fragment_cache = PageCache(config_prefix='FRAGMENT_CACHE')
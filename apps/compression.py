@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import zlib
+
+from flask import g, request
+from werkzeug.http import quote_etag
+
+from .metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ('Compressor', 'compress', 'compressor')
+
+_MIMETYPES = ('text/html', 'text/plain', 'text/css', 'application/json',
+              'application/javascript', 'application/xml', 'image/svg+xml')
+
+
+class _GzipStream(object):
+
+    def __init__(self, level):
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        # Flushed after every chunk, so streamed pages still arrive early.
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        return self._zlib.flush()
+
+
+class _BrotliStream(object):
+
+    def __init__(self, quality):
+        self._brotli = brotli.Compressor(quality=quality)
+
+    def write(self, data):
+        return self._brotli.process(data) + self._brotli.flush()
+
+    def close(self):
+        return self._brotli.finish()
+
+
+def compress(body, encoding, level):
+    '''Returns ``body`` compressed with the ``gzip`` or ``br`` encoding.'''
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    gzip = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return gzip.compress(body) + gzip.flush()
+
+
+def _compress_stream(chunks, charset, stream):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode(charset)
+            data = stream.write(chunk)
+            if data:
+                yield data
+        yield stream.close()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class Compressor(object):
+    '''Compresses responses for clients sending ``Accept-Encoding``.
+
+    Brotli is used if the ``brotli`` module is installed and the client
+    accepts it, gzip otherwise. Streamed responses are compressed as they
+    are sent; others only if at least ``COMPRESS_MIN_SIZE`` bytes long.
+    Responses that are files (``direct_passthrough``) or already encoded,
+    like precompressed static files, are left alone.
+
+    Views serving a page from a ``PageCache`` call ``cache_variants`` so
+    its compressed copies are cached next to it, and hot pages are not
+    compressed again for every request.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.encodings = ()
+        self.levels = {}
+        self.min_size = 512
+        self.mimetypes = _MIMETYPES
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COMPRESS', True)
+        if not self.enabled:
+            return
+
+        self.levels = {'gzip': app.config.get('COMPRESS_LEVEL', 6),
+                       'br': app.config.get('COMPRESS_BR_QUALITY', 5)}
+        self.encodings = ('gzip',) if brotli is None else ('br', 'gzip')
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 512)
+        self.mimetypes = app.config.get('COMPRESS_MIMETYPES', _MIMETYPES)
+        app.after_request(self._after_request)
+
+    def cache_variants(self, cache, key, version):
+        '''Keeps the compressed copies of this request's response in
+        ``cache``, whose entry ``key`` at ``version`` holds its body.'''
+        g.compress_cache = (cache, key, version)
+
+    def _encoding(self):
+        accepted = request.accept_encodings
+        for encoding in self.encodings:
+            if accepted[encoding]:
+                return encoding
+        return None
+
+    def _after_request(self, response):
+        if response.direct_passthrough or \
+           response.mimetype not in self.mimetypes:
+            return response
+
+        # Also on 304s, which update the headers of the cached copy.
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 or \
+           'Content-Encoding' in response.headers:
+            return response
+
+        encoding = self._encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            self._compress_streamed(response, encoding)
+        else:
+            self._compress_body(response, encoding)
+        return response
+
+    def _compress_streamed(self, response, encoding):
+        if encoding == 'br':
+            stream = _BrotliStream(self.levels[encoding])
+        else:
+            stream = _GzipStream(self.levels[encoding])
+        response.response = _compress_stream(response.response,
+                                             response.charset, stream)
+        response.headers.pop('Content-Length', None)
+        self._set_encoding(response, encoding)
+
+    def _compress_body(self, response, encoding):
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return
+
+        cache, key, version = getattr(g, 'compress_cache', (None,) * 3)
+        compressed = None
+        if cache is not None:
+            compressed = cache.get(key, version, variant=encoding)
+        if compressed is None:
+            with metrics.timed('compress'):
+                compressed = compress(body, encoding, self.levels[encoding])
+            if cache is not None:
+                cache.set(key, version, compressed, variant=encoding)
+
+        if len(compressed) < len(body):
+            response.set_data(compressed)
+            self._set_encoding(response, encoding)
+
+    def _set_encoding(self, response, encoding):
+        response.content_encoding = encoding
+        # The compressed body is a different representation, so a strong
+        # ETag of the page is kept only as a weak one.
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            # Werkzeug writes the prefix in lower case.
+            response.headers['ETag'] = 'W/' + quote_etag(etag)
+
+
+compressor = Compressor()
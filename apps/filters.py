@@ -2,7 +2,22 @@
 
 from mistune import Markdown
 
+from .metrics import metrics
+
+_md = Markdown(escape=True)
+
+
+def render_markdown(text):
+    with metrics.timed('markdown'):
+        return _md.render(text)
+
+
+def _markdown(value, field=None):
+    # ``obj|markdown('desc')`` uses the HTML rendered when ``obj`` was saved.
+    if field is not None:
+        return value.get_markdown(field)
+    return render_markdown(value)
+
 
 def init_app(app):
-    md = Markdown(escape=True)
-    app.jinja_env.filters['markdown'] = md.render
+    app.jinja_env.filters['markdown'] = _markdown
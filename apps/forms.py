@@ -1,21 +1,41 @@
 # -*- coding: utf-8 -*-
 
 from flask.ext.wtf import Form
-from wtforms.fields import TextField, PasswordField, BooleanField
+from wtforms import widgets
+from wtforms.fields import Field, TextField, PasswordField, BooleanField
 from wtforms.validators import DataRequired, URL, Email
-from wtforms.ext.sqlalchemy.fields import QuerySelectMultipleField
 from wtforms_alchemy import model_form_factory
 
 from .models import (db, User, Publication, Application, Parameter, Interface,
-                     Download, Project)
+                     Download, Project, project_choices)
 
 
-def _get_projects():
-    return Project.query.all()
+class _ModelForm(model_form_factory(Form)):
+    # Unique validators query the request's session, which already holds
+    # the object being edited.
+    get_session = db.session
 
 
-class _ModelForm(model_form_factory(Form)):
-    get_session = db.create_scoped_session
+class _ProjectsField(Field):
+    '''Lists projects from the cached ``(id, name)`` pairs and only loads the
+    selected ones.'''
+
+    widget = widgets.Select(multiple=True)
+
+    def process_data(self, value):
+        self.data = list(value or [])
+
+    def process_formdata(self, valuelist):
+        ids = set(int(pk) for pk in valuelist if pk.isdigit())
+        self.data = Project.query.filter(Project.id.in_(ids)).all() \
+            if ids else []
+        if len(self.data) != len(valuelist):
+            raise ValueError(self.gettext('Not a valid choice'))
+
+    def iter_choices(self):
+        selected = set(project.id for project in self.data)
+        for id, name in project_choices.get():
+            yield (id, name, id in selected)
 
 
 class SigninForm(Form):
@@ -49,8 +69,7 @@ class UserForm(_ModelForm):
             'email': [Email()]
         }
 
-    projects = QuerySelectMultipleField('Projects', get_label='name',
-                                        query_factory=_get_projects)
+    projects = _ProjectsField('Projects')
 
 
 class SignupForm(UserForm):
@@ -90,21 +109,28 @@ class ApplicationForm(_ModelForm):
 class ParameterForm(_ModelForm):
     class Meta:
         model = Parameter
+        exclude = ('desc_html', 'desc_hash')
 
 
 class InterfaceForm(_ModelForm):
     class Meta:
         model = Interface
+        exclude = ('desc_html', 'desc_hash', 'returns_html', 'returns_hash',
+                   'example_html', 'example_hash')
 
 
 class DownloadForm(_ModelForm):
     class Meta:
         model = Download
+        exclude = ('sha256', 'size')
         validators = {'url': [URL()]}
 
 
 class ProjectForm(_ModelForm):
     class Meta:
         model = Project
-        exclude = ('update_date',)
+        # update_date has a default, so it is left out already.
+        exclude = ('desc_html', 'desc_hash', 'api_desc_html',
+                   'api_desc_hash', 'pubs_version', 'apps_version',
+                   'apis_version', 'contact_version')
         validators = {'github_url': [URL()]}
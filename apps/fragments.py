@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from jinja2 import Markup, nodes
+from jinja2.ext import Extension
+
+from .cache import fragment_cache
+
+__all__ = ('FragmentCacheExtension',)
+
+
+class FragmentCacheExtension(Extension):
+    '''Adds ``{% cache key, version %}...{% endcache %}``.
+
+    The rendered body is kept in ``fragment_cache`` and reused while the
+    version stays the same, so only fragments whose data changed are
+    rendered again. The body must not depend on the viewer.
+    '''
+
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        parser.stream.expect('comma')
+        args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache', args), [], [],
+                               body).set_lineno(lineno)
+
+    def _cache(self, key, version, caller):
+        version = unicode(version)
+        html = fragment_cache.get(key, version)
+        if html is not None:
+            return Markup(html.decode('utf-8'))
+
+        html = caller()
+        fragment_cache.set(key, version, html)
+        return html
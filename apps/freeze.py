@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import fcntl
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import threading
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .assets import assets
+from .jobs import job_queue
+from .models import (db, User, Publication, Application, Parameter,
+                     Interface, Download, Project, project_managers,
+                     get_cache_version)
+
+__all__ = ('Freezer', 'freeze', 'freezer')
+
+MANIFEST_NAME = '.freeze.json'
+
+# Models whose rows are shown on the page of the project they belong to.
+_ITEM_MODELS = (Publication, Application, Interface, Download)
+
+_LOCK_NAME = '.freeze.lock'
+
+# The app of each process of the pool, inherited when the pool forks.
+_worker_app = None
+
+
+def _makedirs(path):
+    # Workers of the pool may create the same folder at once.
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _write(filename, content):
+    # Written aside and renamed, so the web server never sends half a file.
+    _makedirs(os.path.dirname(filename))
+    partial = filename + '.partial'
+    with io.open(partial, 'wb') as f:
+        f.write(content)
+    os.rename(partial, filename)
+
+
+def _render(app, path):
+    response = app.test_client().get(path, buffered=True)
+    if response.status_code != 200:
+        raise RuntimeError('{0} returned {1}'.format(path,
+                                                     response.status_code))
+    return response.data
+
+
+def _project_files(short_name):
+    # (URL, file) of each public page of a project, as the web server
+    # looks them up.
+    return [('/project/{0}'.format(short_name),
+             os.path.join('project', short_name, 'index.html')),
+            ('/api/project/{0}'.format(short_name),
+             os.path.join('api', 'project', short_name + '.json'))]
+
+
+def _freeze_project(app, output, short_name):
+    for path, filename in _project_files(short_name):
+        _write(os.path.join(output, filename), _render(app, path))
+    return short_name
+
+
+def _init_worker(app):
+    global _worker_app
+    _worker_app = app
+    # Connections opened before the fork must not be shared.
+    db.get_engine(app).dispose()
+
+
+def _freeze_project_in_worker(output, short_name):
+    return _freeze_project(_worker_app, output, short_name)
+
+
+def _site_stamp(app):
+    # Every page embeds the layout, static file names and navigation bar.
+    digest = hashlib.sha1()
+    env = app.jinja_env
+    for name in sorted(env.list_templates()):
+        digest.update(name.encode('utf-8'))
+        digest.update(env.loader.get_source(env, name)[0].encode('utf-8'))
+    digest.update(json.dumps(assets.manifest, sort_keys=True))
+    return '{0}:{1}'.format(digest.hexdigest(), get_cache_version('nav'))
+
+
+def _project_stamps(project_ids=None):
+    # Returns the stamp of each project by short name, and the short name
+    # of each project by id.
+    columns = [Project.id, Project.short_name, Project.update_date] + \
+        [getattr(Project, section + '_version')
+         for section in Project.__sections__]
+    query = Project.query.with_entities(*columns)
+    if project_ids is not None:
+        query = query.filter(Project.id.in_(project_ids))
+    stamps = {}
+    names = {}
+    for row in query:
+        stamps[row[1]] = ':'.join(str(value) for value in row[2:])
+        names[str(row[0])] = row[1]
+    return stamps, names
+
+
+def _history_values(target, key):
+    # The value of ``key`` and any it had before the flush.
+    return [getattr(target, key)] + \
+        list(inspect(target).attrs[key].history.deleted or ())
+
+
+def _changed_projects(session):
+    # Ids of the projects whose pages show something the flush changed.
+    project_ids = set()
+    api_ids = set()
+    user_ids = set()
+    for target in itertools.chain(session.new, session.dirty,
+                                  session.deleted):
+        if isinstance(target, Project):
+            project_ids.add(target.id)
+        elif isinstance(target, _ITEM_MODELS):
+            project_ids.update(_history_values(target, 'project_id'))
+        elif isinstance(target, Parameter):
+            api_ids.update(_history_values(target, 'api_id'))
+        elif isinstance(target, User):
+            # Only the name and email are shown, in the contact section.
+            attrs = inspect(target).attrs
+            if attrs.name.history.has_changes() or \
+               attrs.email.history.has_changes():
+                user_ids.add(target.id)
+
+    connection = session.connection()
+    api_ids.discard(None)
+    if api_ids:
+        interface = Interface.__table__
+        project_ids.update(row[0] for row in connection.execute(
+            select([interface.c.project_id])
+            .where(interface.c.id.in_(api_ids))))
+    if user_ids:
+        project_ids.update(row[0] for row in connection.execute(
+            select([project_managers.c.project_id])
+            .where(project_managers.c.user_id.in_(user_ids))))
+    project_ids.discard(None)
+    return project_ids
+
+
+def _copy_static(app, output):
+    # Only files that are new or changed since the last copy are copied.
+    target_folder = os.path.join(output, app.static_url_path.lstrip('/'))
+    count = 0
+    for root, dirs, files in os.walk(app.static_folder):
+        relative = os.path.relpath(root, app.static_folder)
+        for name in files:
+            source = os.path.join(root, name)
+            target = os.path.normpath(
+                os.path.join(target_folder, relative, name))
+            stat = os.stat(source)
+            if os.path.exists(target):
+                copied = os.stat(target)
+                if copied.st_size == stat.st_size and \
+                   int(copied.st_mtime) == int(stat.st_mtime):
+                    continue
+            _makedirs(os.path.dirname(target))
+            shutil.copy2(source, target + '.partial')
+            os.rename(target + '.partial', target)
+            count += 1
+    return count
+
+
+def _read_manifest(output):
+    filename = os.path.join(output, MANIFEST_NAME)
+    if not os.path.exists(filename):
+        return {}
+    with io.open(filename, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def _remove_project(output, short_name):
+    for _, filename in _project_files(short_name):
+        filename = os.path.join(output, filename)
+        if os.path.exists(filename):
+            os.remove(filename)
+    folder = os.path.join(output, 'project', short_name)
+    if os.path.isdir(folder) and not os.listdir(folder):
+        os.rmdir(folder)
+
+
+def freeze(app, output, processes=None, force=False, projects=None):
+    '''Writes the public pages of ``app`` and its static files to ``output``
+    as a web server would serve them.
+
+    A manifest in ``output`` records what each page was rendered from, so
+    later runs only render the projects that changed since, unless
+    ``force`` is set or the templates, static files or navigation bar
+    changed. If ``projects`` lists project ids, only those projects are
+    looked at. Projects are rendered by a pool of ``processes`` (by
+    default one per CPU). Returns a dict of counts.
+    '''
+    _makedirs(output)
+    with io.open(os.path.join(output, _LOCK_NAME), 'wb') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            return _freeze(app, output, processes, force, projects)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _freeze(app, output, processes, force, projects):
+    manifest = _read_manifest(output)
+    frozen_names = manifest.get('ids', {})
+    # Stamps are read before rendering, so a change committed meanwhile is
+    # rendered again by the next run.
+    with app.app_context():
+        site = _site_stamp(app)
+        frozen = manifest.get('projects', {})
+        if force or manifest.get('site') != site:
+            frozen = {}
+        # Runs for some projects need the short name of every project by
+        # id, which full runs record.
+        if not frozen or 'ids' not in manifest:
+            projects = None
+        stamps, names = _project_stamps(projects)
+
+    changed = sorted(short_name for short_name, stamp in stamps.items()
+                     if frozen.get(short_name) != stamp)
+    if projects is None:
+        removed = [short_name for short_name in manifest.get('projects', {})
+                   if short_name not in stamps]
+    else:
+        # Pages of the given projects that were deleted or renamed.
+        removed = [frozen_names[str(id)] for id in projects
+                   if str(id) in frozen_names and
+                   frozen_names[str(id)] not in stamps]
+        # The manifest keeps the other projects as they are.
+        for short_name, stamp in frozen.items():
+            if short_name not in removed:
+                stamps.setdefault(short_name, stamp)
+        for id, short_name in frozen_names.items():
+            if short_name not in removed:
+                names.setdefault(id, short_name)
+
+    static_files = _copy_static(app, output)
+    if not frozen:
+        _write(os.path.join(output, 'index.html'), _render(app, '/'))
+
+    if processes == 1 or len(changed) < 2:
+        for short_name in changed:
+            _freeze_project(app, output, short_name)
+    else:
+        pool = Pool(processes, _init_worker, (app,))
+        try:
+            results = [pool.apply_async(_freeze_project_in_worker,
+                                        (output, short_name))
+                       for short_name in changed]
+            for result in results:
+                result.get()
+        finally:
+            pool.close()
+            pool.join()
+
+    for short_name in removed:
+        _remove_project(output, short_name)
+
+    _write(os.path.join(output, MANIFEST_NAME),
+           json.dumps({'site': site, 'projects': stamps, 'ids': names},
+                      indent=2, sort_keys=True).encode('utf-8'))
+    return {'projects': len(changed), 'removed': len(removed),
+            'index': int(not frozen), 'static_files': static_files}
+
+
+class Freezer(object):
+    '''Freezes projects again after each commit that changed them, when
+    ``FREEZE_ON_COMMIT`` is set.
+
+    Only projects, their items and their managers' names count as changes.
+    Runs happen one at a time, as jobs if ``JOBS_ENABLED`` is set and in a
+    background thread otherwise; projects changed while one is queued are
+    picked up by it.
+    '''
+
+    def __init__(self, app=None):
+        self.output = None
+        self._pool = None
+        self._pending = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.output = app.config.get('FREEZE_DIR')
+        if self.output is None:
+            self.output = os.path.join(app.instance_path, 'freeze')
+        if not app.config.get('FREEZE_ON_COMMIT', False) or \
+           self._pool is not None:
+            return
+
+        self._pool = ThreadPool(1)
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def _after_flush(self, session, flush_context):
+        project_ids = _changed_projects(session)
+        if not project_ids:
+            return
+
+        if job_queue.enabled:
+            for id in sorted(project_ids):
+                job_queue.enqueue('freeze', {'projects': [id]},
+                                  key='freeze:{0}'.format(id),
+                                  connection=session.connection())
+        else:
+            session.info.setdefault('freeze', set()).update(project_ids)
+
+    def _after_rollback(self, session):
+        session.info.pop('freeze', None)
+
+    def _after_commit(self, session):
+        project_ids = session.info.pop('freeze', None)
+        if project_ids:
+            self.schedule(current_app._get_current_object(), project_ids)
+
+    def schedule(self, app, project_ids):
+        '''Freezes the projects of ``project_ids`` in the background.'''
+        with self._lock:
+            if self._pending is not None:
+                self._pending.update(project_ids)
+                return
+            self._pending = set(project_ids)
+        self._pool.apply_async(self._run, (app,))
+
+    def _run(self, app):
+        with self._lock:
+            project_ids, self._pending = self._pending, None
+        try:
+            freeze(app, self.output, processes=1, projects=project_ids)
+        except Exception:
+            app.logger.exception('Could not freeze the site')
+
+
+freezer = Freezer()
+
+
+@job_queue.task('freeze')
+def _freeze_changed(projects=None):
+    freeze(current_app._get_current_object(), freezer.output, processes=1,
+           projects=projects)
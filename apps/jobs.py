@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from .metrics import Histogram, metrics
+from .models import db, Project, Interface, Parameter
+
+__all__ = ('JobQueue', 'jobs', 'job_queue')
+
+jobs = db.Table(
+    'job',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String(64), nullable=False),
+    db.Column('key', db.String(128), index=True),
+    db.Column('args', db.Text, nullable=False),
+    db.Column('state', db.String(16), nullable=False),
+    db.Column('attempts', db.Integer, nullable=False),
+    # Seconds since the epoch.
+    db.Column('created_at', db.Float, nullable=False),
+    db.Column('run_at', db.Float, nullable=False),
+    db.Column('locked_until', db.Float),
+    db.Column('error', db.Text),
+    db.Index('ix_job_state_run_at', 'state', 'run_at'))
+
+_PENDING = 'pending'
+_FAILED = 'failed'
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+class JobQueue(object):
+    '''Runs work deferred until after the commit that needed it.
+
+    Jobs are rows of the ``job`` table, queued in the same transaction as
+    the change that needs them, so they survive restarts. With
+    ``JOBS_ENABLED``, ``manage.py worker`` runs them, and so do
+    ``JOBS_THREADS`` threads of each app process if set, started when the
+    process handles its first request. A job is dropped if one with the
+    same key is already waiting. This is best-effort: two transactions
+    queueing the same key at once may both queue it, so tasks must be
+    safe to run twice. Failed jobs are retried after ``JOBS_RETRY_DELAY``
+    seconds, doubled after every attempt, until ``JOBS_MAX_ATTEMPTS``
+    attempts fail.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.threads = 0
+        self.tasks = {}
+        self.max_attempts = 5
+        self.retry_delay = 2
+        self.poll_interval = 1
+        self.lease = 300
+        self.wait_seconds = Histogram(
+            'job_wait_seconds',
+            'Time from queueing a job to starting it, by job.',
+            ('job',), _LATENCY_BUCKETS)
+        self.run_seconds = Histogram(
+            'job_run_seconds', 'Time taken to run a job, by job.',
+            ('job',), _LATENCY_BUCKETS)
+        self._totals = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._threads_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('JOBS_ENABLED', False)
+        if not self.enabled:
+            return
+
+        self.max_attempts = app.config.get('JOBS_MAX_ATTEMPTS', 5)
+        self.retry_delay = app.config.get('JOBS_RETRY_DELAY', 2)
+        self.poll_interval = app.config.get('JOBS_POLL_INTERVAL', 1)
+        self.lease = app.config.get('JOBS_LEASE', 300)
+        for Model in _MARKDOWN_MODELS.values():
+            Model.defer_markdown = True
+
+        event.listen(Session, 'after_commit', self._after_commit)
+        metrics.add_collector(self)
+        # Not started here, so commands and the master process of a
+        # preforking server run no jobs, and forked workers start their own.
+        self.threads = app.config.get('JOBS_THREADS', 0)
+        if self.threads:
+            app.before_request(self._start_in_process)
+
+    def task(self, name):
+        '''Registers a function to run jobs queued under ``name``.'''
+        def decorator(f):
+            self.tasks[name] = f
+            return f
+        return decorator
+
+    def enqueue(self, name, args=None, key=None, delay=0, connection=None):
+        '''Queues a job unless one with the same ``key`` is waiting, as far
+        as this transaction can see.
+
+        The job is added in the transaction of ``connection`` (by default
+        the session's), so it is only run once that transaction commits.
+        Returns whether it was queued.
+        '''
+        if connection is None:
+            connection = db.session
+
+        if key is not None:
+            waiting = connection.execute(
+                select([jobs.c.id])
+                .where((jobs.c.key == key) & (jobs.c.state == _PENDING) &
+                       jobs.c.locked_until.is_(None))
+                .limit(1)).first()
+            if waiting is not None:
+                return False
+
+        now = time.time()
+        connection.execute(jobs.insert().values(
+            name=name, key=key, args=json.dumps(args or {}), state=_PENDING,
+            attempts=0, created_at=now, run_at=now + delay))
+        return True
+
+    def _after_commit(self, session):
+        if not session.info.get('quiet_commit'):
+            self._wakeup.set()
+
+    def _commit_quietly(self):
+        # Claims and retries queue no jobs, so need not wake the workers.
+        session = db.session()
+        session.info['quiet_commit'] = True
+        try:
+            session.commit()
+        finally:
+            session.info.pop('quiet_commit', None)
+
+    def start(self, app, threads):
+        '''Runs jobs in the background until ``stop`` is called, with
+        ``threads`` threads in all.'''
+        self._stop.clear()
+        for _ in range(threads - len(self._threads)):
+            thread = threading.Thread(target=self._work, args=(app,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _start_in_process(self):
+        pid = os.getpid()
+        if self._threads_pid == pid:
+            return
+        with self._lock:
+            if self._threads_pid == pid:
+                return
+            # Threads do not survive a fork.
+            self._threads = []
+            self.start(current_app._get_current_object(), self.threads)
+            self._threads_pid = pid
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self, app):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                with app.app_context():
+                    ran = self.run_once()
+            except Exception:
+                app.logger.exception('Could not run jobs')
+                ran = False
+            if not ran:
+                self._wakeup.wait(self.poll_interval)
+
+    def run_once(self):
+        '''Runs the next due job, if any. Returns whether there was one.'''
+        job = self._claim()
+        if job is None:
+            return False
+
+        start = time.time()
+        try:
+            self.tasks[job.name](**json.loads(job.args))
+            db.session.execute(jobs.delete().where(jobs.c.id == job.id))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception('Job %s failed', job.name)
+            outcome = self._retry(job, e)
+        else:
+            outcome = 'done'
+
+        self._record(job, start, outcome)
+        return True
+
+    def _claim(self):
+        # Another worker may claim the same job first, so each claim only
+        # succeeds if the job is still unclaimed.
+        now = time.time()
+        unclaimed = jobs.c.locked_until.is_(None) | \
+            (jobs.c.locked_until < now)
+        candidates = db.session.execute(
+            select([jobs])
+            .where((jobs.c.state == _PENDING) & (jobs.c.run_at <= now) &
+                   unclaimed)
+            .order_by(jobs.c.run_at, jobs.c.id)
+            .limit(len(self._threads) + 1)).fetchall()
+        # Ends the read without a commit, which would wake the workers.
+        db.session.rollback()
+
+        for job in candidates:
+            claimed = db.session.execute(
+                jobs.update().where((jobs.c.id == job.id) & unclaimed)
+                .values(locked_until=now + self.lease,
+                        attempts=job.attempts + 1)).rowcount
+            self._commit_quietly()
+            if claimed:
+                return job
+        return None
+
+    def _retry(self, job, error):
+        attempts = job.attempts + 1
+        values = {'locked_until': None, 'error': repr(error)}
+        if attempts >= self.max_attempts:
+            values['state'] = _FAILED
+            outcome = 'failed'
+        else:
+            values['run_at'] = \
+                time.time() + self.retry_delay * 2 ** (attempts - 1)
+            outcome = 'retried'
+        db.session.execute(jobs.update().where(jobs.c.id == job.id)
+                           .values(**values))
+        self._commit_quietly()
+        return outcome
+
+    def _record(self, job, start, outcome):
+        wait = start - job.created_at
+        run = time.time() - start
+        self.wait_seconds.observe((job.name,), wait)
+        self.run_seconds.observe((job.name,), run)
+        with self._lock:
+            totals = self._totals.setdefault(job.name, {
+                'done': 0, 'retried': 0, 'failed': 0, 'wait_seconds': 0.0,
+                'run_seconds': 0.0})
+            totals[outcome] += 1
+            totals['wait_seconds'] += wait
+            totals['run_seconds'] += run
+
+    def depth(self):
+        '''Returns the number of jobs by state and the age in seconds of the
+        oldest waiting job.'''
+        rows = db.session.execute(
+            select([jobs.c.state, func.count(), func.min(jobs.c.created_at)])
+            .group_by(jobs.c.state)).fetchall()
+        depth = {_PENDING: 0, _FAILED: 0}
+        oldest = None
+        for state, count, created_at in rows:
+            depth[state] = count
+            if state == _PENDING:
+                oldest = time.time() - created_at
+        return depth, oldest
+
+    def stats(self):
+        '''Returns the queue depth and, for the jobs run by this process,
+        counts and mean latencies by job.'''
+        depth, oldest = self.depth()
+        stats = {'depth': depth, 'oldest_pending_seconds': oldest,
+                 'jobs': {}}
+        with self._lock:
+            for name, totals in self._totals.items():
+                count = totals['done'] + totals['retried'] + totals['failed']
+                stats['jobs'][name] = {
+                    'done': totals['done'],
+                    'retried': totals['retried'],
+                    'failed': totals['failed'],
+                    'mean_wait_ms': totals['wait_seconds'] / count * 1000,
+                    'mean_run_ms': totals['run_seconds'] / count * 1000
+                }
+        return stats
+
+    def export(self):
+        depth, oldest = self.depth()
+        lines = ['# HELP job_queue_depth Jobs in the queue by state.',
+                 '# TYPE job_queue_depth gauge']
+        for state, count in sorted(depth.items()):
+            lines.append('job_queue_depth{{state="{0}"}} {1}'.format(
+                state, count))
+        lines.extend(['# HELP job_queue_oldest_pending_seconds Age of the '
+                      'oldest waiting job.',
+                      '# TYPE job_queue_oldest_pending_seconds gauge',
+                      'job_queue_oldest_pending_seconds {0!r}'.format(
+                          oldest or 0.0)])
+        lines.extend(self.wait_seconds.export())
+        lines.extend(self.run_seconds.export())
+        return lines
+
+
+job_queue = JobQueue()
+
+
+_MARKDOWN_MODELS = dict((Model.__tablename__, Model)
+                        for Model in (Project, Interface, Parameter))
+
+
+@job_queue.task('render_markdown')
+def _render_markdown(table, id):
+    Model = _MARKDOWN_MODELS[table]
+    columns = Model.__table__.c
+    row = db.session.execute(
+        select([columns[field] for field in Model.__markdown__])
+        .where(columns.id == id)).first()
+    if row is None:
+        return
+
+    data = dict((field, text) for field, text in row.items()
+                if text is not None)
+    if data:
+        db.session.execute(Model.__table__.update()
+                           .where(columns.id == id)
+                           .values(**Model.markdown_columns(data)))
+
+
+def _queue_markdown(mapper, connection, target):
+    if target.defer_markdown and target.stale_markdown():
+        table = mapper.class_.__tablename__
+        job_queue.enqueue('render_markdown', {'table': table, 'id': target.id},
+                          key='markdown:{0}:{1}'.format(table, target.id),
+                          connection=connection)
+
+
+for _Model in _MARKDOWN_MODELS.values():
+    event.listen(_Model, 'after_insert', _queue_markdown)
+    event.listen(_Model, 'after_update', _queue_markdown)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, request
+from sqlalchemy import event
+
+__all__ = ('Metrics', 'Histogram', 'metrics')
+
+_PHASES = ('sql', 'template', 'markdown', 'minify', 'compress')
+
+_DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                     0.5, 1.0, 2.5, 5.0, 10.0)
+
+_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    '''A Prometheus histogram with one series per tuple of label values.'''
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = \
+                    [[0] * len(self.buckets), 0.0, 0]
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _format_labels(self, label_values, extra=()):
+        pairs = list(zip(self.labels, label_values)) + list(extra)
+        return ','.join('{0}="{1}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for name, value in pairs)
+
+    def export(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help),
+                 '# TYPE {0} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((key, [list(value[0]), value[1], value[2]])
+                            for key, value in self._series.items())
+
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('{0}_bucket{{{1}}} {2}'.format(
+                    self.name,
+                    self._format_labels(label_values, [('le', repr(bound))]),
+                    cumulative))
+            lines.append('{0}_bucket{{{1}}} {2}'.format(
+                self.name, self._format_labels(label_values, [('le', '+Inf')]),
+                count))
+            labels = self._format_labels(label_values)
+            lines.append('{0}_sum{{{1}}} {2!r}'.format(
+                self.name, labels, total))
+            lines.append('{0}_count{{{1}}} {2}'.format(
+                self.name, labels, count))
+        return lines
+
+
+class _RequestTimer(object):
+    '''Adds up the time of one request by phase.
+
+    Phases nest (SQL runs while a template renders, which runs while the
+    minifier pulls from it), so each one is charged only its own time.
+    '''
+
+    def __init__(self):
+        self.start = time.time()
+        self.totals = dict((phase, 0.0) for phase in _PHASES)
+        self.sql_count = 0
+        self._stack = []
+
+    def push(self, phase):
+        frame = [phase, time.time(), 0.0]
+        self._stack.append(frame)
+        return frame
+
+    def pop(self, frame):
+        while self._stack:
+            top = self._stack.pop()
+            elapsed = time.time() - top[1]
+            self.totals[top[0]] += elapsed - top[2]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+            if top is frame:
+                break
+
+
+class _Timed(object):
+
+    def __init__(self, local, phase):
+        self._local = local
+        self._phase = phase
+        self._frame = None
+
+    def __enter__(self):
+        timer = getattr(self._local, 'timer', None)
+        if timer is not None:
+            self._frame = timer.push(self._phase)
+
+    def __exit__(self, *exc_info):
+        timer = getattr(self._local, 'timer', None)
+        if timer is not None and self._frame is not None:
+            timer.pop(self._frame)
+
+
+class _NullTimed(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_timed = _NullTimed()
+
+
+class Metrics(object):
+    '''Times requests by endpoint when ``METRICS_ENABLED`` is set.
+
+    Timings are sent in a ``Server-Timing`` header and kept as histograms
+    served at ``/metrics`` in the Prometheus text format. Histograms are
+    per worker process. A streamed page is still rendering when its
+    headers are sent, so its header only covers the work done before
+    that; the histograms are updated once the whole body is sent.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._local = threading.local()
+        self.request_seconds = Histogram(
+            'http_request_duration_seconds',
+            'Wall time of requests by endpoint.',
+            ('endpoint',), _DURATION_BUCKETS)
+        self.phase_seconds = Histogram(
+            'http_request_phase_seconds',
+            'Time spent in SQL, templates, Markdown and minifying by '
+            'endpoint.',
+            ('endpoint', 'phase'), _DURATION_BUCKETS)
+        self.sql_statements = Histogram(
+            'http_request_sql_statements',
+            'SQL statements run per request by endpoint.',
+            ('endpoint',), _COUNT_BUCKETS)
+        self._collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, engine=None):
+        if not app.config.get('METRICS_ENABLED', False):
+            return
+
+        self.enabled = True
+        if engine is not None:
+            event.listen(engine, 'before_cursor_execute', self._before_sql)
+            event.listen(engine, 'after_cursor_execute', self._after_sql)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    def add_collector(self, collector):
+        '''Adds the lines returned by ``collector.export()`` to /metrics.'''
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def timed(self, phase):
+        '''Returns a context manager charging its body to ``phase``.'''
+        if not self.enabled:
+            return _null_timed
+        return _Timed(self._local, phase)
+
+    def timed_iter(self, phase, iterable):
+        '''Charges the time taken to produce each item to ``phase``.'''
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(phase, iterable)
+
+    def _timed_iter(self, phase, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.timed(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def _before_sql(self, conn, cursor, statement, parameters, context,
+                    executemany):
+        timer = getattr(self._local, 'timer', None)
+        if timer is not None:
+            timer.sql_count += 1
+            conn.info['metrics_frame'] = timer.push('sql')
+
+    def _after_sql(self, conn, cursor, statement, parameters, context,
+                   executemany):
+        timer = getattr(self._local, 'timer', None)
+        frame = conn.info.pop('metrics_frame', None)
+        if timer is not None and frame is not None:
+            timer.pop(frame)
+
+    def _start_request(self):
+        self._local.timer = _RequestTimer()
+
+    def _finish_request(self, response):
+        timer = getattr(self._local, 'timer', None)
+        if timer is None:
+            return response
+
+        response.headers['Server-Timing'] = self._server_timing(timer)
+        endpoint = request.endpoint or 'none'
+        response.call_on_close(lambda: self._record(endpoint, timer))
+        return response
+
+    def _server_timing(self, timer):
+        timings = ['total;dur={0:.2f}'.format(
+            (time.time() - timer.start) * 1000)]
+        for phase in _PHASES:
+            timing = '{0};dur={1:.2f}'.format(phase,
+                                              timer.totals[phase] * 1000)
+            if phase == 'sql':
+                timing += ';desc="{0} statements"'.format(timer.sql_count)
+            timings.append(timing)
+        return ', '.join(timings)
+
+    def _record(self, endpoint, timer):
+        if getattr(self._local, 'timer', None) is timer:
+            self._local.timer = None
+
+        self.request_seconds.observe((endpoint,), time.time() - timer.start)
+        for phase in _PHASES:
+            self.phase_seconds.observe((endpoint, phase),
+                                       timer.totals[phase])
+        self.sql_statements.observe((endpoint,), timer.sql_count)
+
+    def export(self):
+        lines = []
+        for histogram in (self.request_seconds, self.phase_seconds,
+                          self.sql_statements):
+            lines.extend(histogram.export())
+        for collector in self._collectors:
+            lines.extend(collector.export())
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import hashlib
+import mimetypes
+import os
+import posixpath
+import tempfile
+import urllib2
+import urlparse
+from datetime import datetime
+
+from flask import Response, request, url_for
+from werkzeug.datastructures import ContentRange
+from werkzeug.wsgi import wrap_file
+
+__all__ = ('DownloadMirror', 'mirror')
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _read_range(f, length):
+    try:
+        while length > 0:
+            chunk = f.read(min(_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+class DownloadMirror(object):
+    '''Keeps local copies of downloads, named by their SHA-256, and serves
+    them with range requests and strong ETags.
+
+    With ``DOWNLOAD_MIRROR`` set, pages link mirrored downloads to
+    ``/download/<id>`` instead of their URL. Files are streamed from disk,
+    or handed to the web server with ``DOWNLOAD_SENDFILE``.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.folder = None
+        self.sendfile = None
+        self.accel_prefix = '/_mirror/'
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('DOWNLOAD_MIRROR', False)
+        self.folder = app.config.get('DOWNLOAD_MIRROR_DIR')
+        if self.folder is None:
+            self.folder = os.path.join(app.instance_path, 'downloads')
+        self.sendfile = app.config.get('DOWNLOAD_SENDFILE')
+        self.accel_prefix = app.config.get('DOWNLOAD_ACCEL_PREFIX',
+                                           '/_mirror/')
+        app.jinja_env.globals['download_url'] = self.url_for
+
+    def _relative_path(self, sha256):
+        return posixpath.join(sha256[:2], sha256[2:])
+
+    def path(self, sha256):
+        return os.path.join(self.folder, sha256[:2], sha256[2:])
+
+    def has(self, sha256):
+        return sha256 is not None and os.path.isfile(self.path(sha256))
+
+    def url_for(self, download):
+        if self.enabled and download.sha256:
+            return url_for('projects.download', download_id=download.id)
+        return download.url
+
+    def store(self, stream, sha256=None):
+        '''Copies a file object into the mirror, hashing it on the way.
+
+        Returns its SHA-256 and size. Raises ``ValueError`` and keeps
+        nothing if ``sha256`` is given and does not match.
+        '''
+        _makedirs(self.folder)
+        fd, partial = tempfile.mkstemp(suffix='.partial', dir=self.folder)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            actual = digest.hexdigest()
+            if sha256 is not None and actual != sha256.lower():
+                raise ValueError('SHA-256 is {0}, expected {1}'.format(
+                    actual, sha256))
+
+            path = self.path(actual)
+            if not os.path.exists(path):
+                # Readable by a web server sending it with DOWNLOAD_SENDFILE.
+                os.chmod(partial, 0o644)
+                _makedirs(os.path.dirname(path))
+                os.rename(partial, path)
+        finally:
+            # Left over if the file was mirrored already or the copy failed.
+            if os.path.exists(partial):
+                os.remove(partial)
+        return actual, size
+
+    def fetch(self, url, sha256=None):
+        '''Stores the file at ``url``, which may be a ``file://`` URL.'''
+        response = urllib2.urlopen(url, timeout=60)
+        try:
+            return self.store(response, sha256)
+        finally:
+            response.close()
+
+    def prune(self, keep):
+        '''Removes the files whose SHA-256 is not in ``keep``.'''
+        removed = 0
+        for root, dirs, files in os.walk(self.folder):
+            # Files still being stored are in the top folder.
+            if root == self.folder:
+                continue
+            for name in files:
+                sha256 = os.path.basename(root) + name
+                if sha256 not in keep:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+        return removed
+
+    def _requested_range(self, sha256, size, last_modified):
+        # Returns (start, stop), None for the whole file or False if the
+        # range cannot be satisfied. Several ranges get the whole file.
+        byte_range = request.range
+        if byte_range is None or byte_range.units != 'bytes' or \
+           len(byte_range.ranges) != 1:
+            return None
+
+        # If-Range only matches exactly, and never with a weak ETag, which
+        # Werkzeug drops the W/ prefix of.
+        if_range = request.if_range
+        if if_range.etag is not None and (
+                if_range.etag != sha256 or
+                request.headers['If-Range'].lstrip()[:2] in ('W/', 'w/')):
+            return None
+        if if_range.date is not None and if_range.date != last_modified:
+            return None
+        return byte_range.range_for_length(size) or False
+
+    def send(self, sha256, url):
+        '''Responds with the mirrored file, named after the last part of
+        its ``url``.'''
+        path = self.path(sha256)
+        stat = os.stat(path)
+        filename = posixpath.basename(urlparse.urlsplit(url).path) or \
+            'download'
+        last_modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+
+        response = Response(
+            mimetype=mimetypes.guess_type(filename)[0] or
+            'application/octet-stream', direct_passthrough=True)
+        response.set_etag(sha256)
+        response.last_modified = last_modified
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers.add('Content-Disposition', 'attachment',
+                             filename=filename)
+        response.cache_control.public = True
+
+        if request.if_none_match.contains_weak(sha256) or \
+           (not request.if_none_match and request.if_modified_since and
+                last_modified <= request.if_modified_since):
+            response.status_code = 304
+            return response
+
+        # The web server sends the file and answers range requests itself.
+        if self.sendfile == 'x-sendfile':
+            response.headers['X-Sendfile'] = path
+            return response
+        if self.sendfile == 'x-accel-redirect':
+            response.headers['X-Accel-Redirect'] = \
+                self.accel_prefix + self._relative_path(sha256)
+            return response
+
+        byte_range = self._requested_range(sha256, stat.st_size,
+                                           last_modified)
+        if byte_range is False:
+            response.status_code = 416
+            response.headers['Content-Range'] = \
+                'bytes */{0}'.format(stat.st_size)
+            return response
+
+        f = open(path, 'rb')
+        if byte_range is None:
+            # Servers may send this with sendfile(2).
+            response.response = wrap_file(request.environ, f, _CHUNK_SIZE)
+            response.content_length = stat.st_size
+            return response
+
+        start, stop = byte_range
+        f.seek(start)
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, stop,
+                                              stat.st_size)
+        response.content_length = stop - start
+        response.response = _read_range(f, stop - start)
+        return response
+
+
+mirror = DownloadMirror()
@@ -1,24 +1,157 @@
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
 
-from flask.ext.login import UserMixin
+from flask.ext.login import AnonymousUserMixin, UserMixin
 from flask.ext.sqlalchemy import SQLAlchemy
-from passlib.hash import sha256_crypt
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from .cache import TTLCache, VersionedValue
+from .filters import render_markdown
+from .passwords import passwords
 
 __all__ = ('db', 'User', 'Publication', 'Application', 'Parameter',
-           'Interface', 'Download', 'Project')
+           'Interface', 'Download', 'Project', 'QueryCounter',
+           'get_cache_version', 'bump_cache_version', 'nav_cache',
+           'project_choices',
+           'UserSnapshot', 'AnonymousUser', 'user_cache', 'unit_of_work',
+           'bulk_listeners')
 
 db = SQLAlchemy()
 
 project_managers = db.Table(
     'project_managers',
     db.Column('project_id', db.Integer, db.ForeignKey('project.id')),
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id')))
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), index=True),
+    # Also serves lookups by project.
+    db.Index('ix_project_managers_project_id_user_id',
+             'project_id', 'user_id', unique=True))
+
+# Counters shared by all worker processes, bumped whenever data cached in
+# every process changes.
+_CACHE_VERSIONS = ('nav',)
+
+cache_versions = db.Table(
+    'cache_version',
+    db.Column('name', db.String(32), primary_key=True),
+    db.Column('version', db.Integer, nullable=False, default=0),
+    # UTC time of the last bump.
+    db.Column('changed_at', db.DateTime))
+
+
+@event.listens_for(cache_versions, 'after_create')
+def _insert_cache_versions(target, connection, **kwargs):
+    connection.execute(cache_versions.insert(),
+                       [{'name': name, 'version': 0,
+                         'changed_at': datetime.utcnow()}
+                        for name in _CACHE_VERSIONS])
+
+
+def get_cache_version(name):
+    return db.session.query(cache_versions.c.version) \
+        .filter(cache_versions.c.name == name).scalar() or 0
+
+
+def bump_cache_version(name, connection=None):
+    if connection is None:
+        connection = db.session
+    connection.execute(
+        cache_versions.update()
+        .where(cache_versions.c.name == name)
+        .values(version=cache_versions.c.version + 1,
+                changed_at=datetime.utcnow()))
+
+
+class QueryCounter(object):
+    '''Counts the SQL statements executed while the context is active.
+
+        with QueryCounter() as counter:
+            Project.graph_query().filter_by(short_name='cn').first()
+        print(counter.count)
+
+    ``tests/test_models.py`` uses it to check that loading a project costs
+    the same number of queries however many items it has.
+    '''
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        if self.engine is None:
+            self.engine = db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+_local = threading.local()
+
+# SQLite allows at most 999 bound parameters per statement.
+_IN_CLAUSE_SIZE = 500
+
+
+@contextmanager
+def unit_of_work():
+    '''Defers the commits of CRUD operations to a single commit at the end.
+
+        with unit_of_work():
+            for data in rows:
+                Publication.create(**data)
+    '''
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield db.session
+        if _local.depth == 1:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        _local.depth -= 1
+
+
+def _commit(commit):
+    if commit and not getattr(_local, 'depth', 0):
+        db.session.commit()
+
+
+def _chunks(items, size=_IN_CLAUSE_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _hash_markdown(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
 
 
 class _CRUDMixin(object):
 
+    # Markdown columns; each ``<field>`` has ``<field>_html`` and
+    # ``<field>_hash`` columns holding its rendered HTML and source hash.
+    __markdown__ = ()
+
+    # Page sections; each ``<section>`` has a ``<section>_version`` column
+    # bumped whenever what the section shows changes.
+    __sections__ = ()
+
+    # Columns worked out from the others, which exports leave out.
+    __derived__ = ()
+
+    # Set by the job queue, which renders Markdown after the commit instead
+    # of on save.
+    defer_markdown = False
+
     id = db.Column(db.Integer, primary_key=True, nullable=False)
 
     @classmethod
@@ -38,15 +171,120 @@ class _CRUDMixin(object):
             setattr(self, attr, value)
         return commit and self.save() or self
 
+    @classmethod
+    def bulk_create(cls, rows, commit=True):
+        '''Inserts dicts of column data with a single executemany.'''
+        table = cls.__table__
+        rows = [dict(row, **cls.markdown_columns(row)) for row in rows]
+        if rows:
+            last_id = 0
+            if bulk_listeners:
+                last_id = db.session.query(
+                    db.func.max(table.c.id)).scalar() or 0
+            db.session.execute(table.insert(), rows)
+            _bulk_changed(cls, rows=rows)
+            _notify_bulk(cls, where=table.c.id > last_id)
+        _commit(commit)
+
+    @classmethod
+    def bulk_update(cls, rows, commit=True):
+        '''Updates rows from dicts of column data, each including ``id``.'''
+        table = cls.__table__
+        statement = table.update().where(table.c.id == db.bindparam('_id'))
+
+        # An executemany needs the same columns in every row.
+        groups = {}
+        for row in rows:
+            row = dict(row, **cls.markdown_columns(row))
+            row['_id'] = row.pop('id')
+            if cls is Download and 'url' in row:
+                # As on update, the mirrored copy is of the old URL.
+                row.setdefault('sha256', None)
+                row.setdefault('size', None)
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        for group in groups.values():
+            db.session.execute(statement, group)
+        ids = [row['_id'] for group in groups.values() for row in group]
+        _bulk_changed(cls, ids=ids)
+        for chunk in _chunks(ids):
+            _notify_bulk(cls, where=table.c.id.in_(chunk))
+        _commit(commit)
+
+    @classmethod
+    def bulk_delete(cls, ids, commit=True):
+        '''Deletes the rows with the given ids.'''
+        table = cls.__table__
+        ids = list(ids)
+        _bulk_changed(cls, ids=ids)
+        for chunk in _chunks(ids):
+            db.session.execute(table.delete().where(table.c.id.in_(chunk)))
+        _notify_bulk(cls, deleted=ids)
+        _commit(commit)
+
+    @classmethod
+    def data_columns(cls):
+        '''Returns the columns holding data, leaving out derived columns.'''
+        derived = set(section + '_version' for section in cls.__sections__)
+        derived.update(cls.__derived__)
+        for field in cls.__markdown__:
+            derived.update((field + '_html', field + '_hash'))
+        return [column for column in cls.__table__.columns
+                if column.name not in derived]
+
+    def to_dict(self):
+        data = {}
+        for column in self.data_columns():
+            value = getattr(self, column.name)
+            if isinstance(value, date):
+                value = value.isoformat()
+            data[column.name] = value
+        return data
+
+    @classmethod
+    def markdown_columns(cls, data):
+        '''Returns the rendered Markdown columns for a dict of column data.'''
+        columns = {}
+        for field in cls.__markdown__:
+            if field not in data:
+                continue
+
+            text = data[field]
+            columns[field + '_html'] = render_markdown(text)
+            columns[field + '_hash'] = _hash_markdown(text)
+        return columns
+
+    def stale_markdown(self):
+        '''Returns the Markdown fields whose HTML is out of date.'''
+        return [field for field in self.__markdown__
+                if getattr(self, field) is not None and
+                getattr(self, field + '_hash') !=
+                _hash_markdown(getattr(self, field))]
+
+    def render_markdown(self):
+        for field in self.stale_markdown():
+            text = getattr(self, field)
+            setattr(self, field + '_html', render_markdown(text))
+            setattr(self, field + '_hash', _hash_markdown(text))
+
+    def get_markdown(self, field):
+        text = getattr(self, field)
+        html = getattr(self, field + '_html')
+        if html is not None and \
+           getattr(self, field + '_hash') == _hash_markdown(text):
+            return html
+        return render_markdown(text)
+
     def save(self, commit=True):
+        if not self.defer_markdown:
+            self.render_markdown()
         db.session.add(self)
-        if commit:
-            db.session.commit()
+        _commit(commit)
         return self
 
     def delete(self, commit=True):
         db.session.delete(self)
-        return commit and db.session.commit()
+        _commit(commit)
 
 
 class User(_CRUDMixin, UserMixin, db.Model):
@@ -69,13 +307,75 @@ class User(_CRUDMixin, UserMixin, db.Model):
     @classmethod
     def login(cls, email, pwd):
         user = cls.query.filter_by(email=email).first()
-        if user is None or not sha256_crypt.verify(pwd, user.pwd):
+        if user is None:
             return None
 
+        is_valid, new_pwd = passwords.verify_and_update(pwd, user.pwd)
+        if not is_valid:
+            return None
+
+        # The hash settings were changed since the password was set.
+        if new_pwd is not None:
+            user.update(pwd=new_pwd)
+
         return user
 
     def set_pwd(self, pwd):
-        self.pwd = sha256_crypt.encrypt(pwd)
+        self.pwd = passwords.encrypt(pwd)
+
+    def can_manage(self, project):
+        if self.is_admin:
+            return True
+
+        return db.session.query(db.exists().where(
+            (project_managers.c.project_id == project.id) &
+            (project_managers.c.user_id == self.id))).scalar()
+
+
+class UserSnapshot(UserMixin):
+    '''Read-only copy of a signed-in user, cached across requests.
+
+    It holds the ids of the projects the user manages, so permission
+    checks need no queries.
+    '''
+
+    def __init__(self, user):
+        self.id = user.id
+        self.email = user.email
+        self.name = user.name
+        self.is_admin = user.is_admin
+        self.managed_project_ids = frozenset(
+            project.id for project in user.projects)
+
+    def can_manage(self, project):
+        return self.is_admin or project.id in self.managed_project_ids
+
+    @classmethod
+    def get(cls, user_id):
+        # A malformed session or remember cookie means nobody signed in.
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+
+        snapshot = user_cache.get(user_id)
+        if snapshot is None:
+            user = User.get(user_id)
+            if user is None:
+                return None
+            snapshot = user_cache.set(user_id, cls(user))
+        return snapshot
+
+
+class AnonymousUser(AnonymousUserMixin):
+    is_admin = False
+    managed_project_ids = frozenset()
+
+    def can_manage(self, project):
+        return False
+
+
+user_cache = TTLCache()
 
 
 class Publication(_CRUDMixin, db.Model):
@@ -95,7 +395,8 @@ class Publication(_CRUDMixin, db.Model):
         db.Date, nullable=False,
         info={'label': 'Publish Date'})
 
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'),
+                           index=True)
 
     def __str__(self):
         return self.title
@@ -118,7 +419,8 @@ class Application(_CRUDMixin, db.Model):
         db.Text, nullable=False,
         info={'label': 'Description'})
 
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'),
+                           index=True)
 
     def __str__(self):
         return self.name
@@ -127,6 +429,7 @@ class Application(_CRUDMixin, db.Model):
 class Parameter(_CRUDMixin, db.Model):
     __tablename__ = 'parameter'
     __caption__ = 'Parameter'
+    __markdown__ = ('desc',)
 
     name = db.Column(
         db.String(32), nullable=False,
@@ -134,8 +437,11 @@ class Parameter(_CRUDMixin, db.Model):
     desc = db.Column(
         db.Text, nullable=False,
         info={'label': 'Description'})
+    desc_html = db.Column(db.Text)
+    desc_hash = db.Column(db.String(40))
 
-    api_id = db.Column(db.Integer, db.ForeignKey('interface.id'))
+    api_id = db.Column(db.Integer, db.ForeignKey('interface.id'),
+                       index=True)
 
     def __str__(self):
         return self.name
@@ -144,6 +450,7 @@ class Parameter(_CRUDMixin, db.Model):
 class Interface(_CRUDMixin, db.Model):
     __tablename__ = 'interface'
     __caption__ = 'Web API'
+    __markdown__ = ('desc', 'returns', 'example')
 
     method = db.Column(
         db.Enum('GET', 'POST', 'PUT', 'DELETE', name='Method'), nullable=False,
@@ -154,16 +461,23 @@ class Interface(_CRUDMixin, db.Model):
     desc = db.Column(
         db.Text, nullable=False,
         info={'label': 'Description'})
+    desc_html = db.Column(db.Text)
+    desc_hash = db.Column(db.String(40))
     returns = db.Column(
         db.Text, nullable=False,
         info={'label': 'Returns'})
+    returns_html = db.Column(db.Text)
+    returns_hash = db.Column(db.String(40))
     example = db.Column(
         db.Text, nullable=False,
         info={'label': 'Example'})
+    example_html = db.Column(db.Text)
+    example_hash = db.Column(db.String(40))
 
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'),
+                           index=True)
 
-    params = db.relationship('Parameter', lazy='dynamic')
+    params = db.relationship('Parameter')
 
     def __str__(self):
         return '[ {0} ] {1}'.format(self.method, self.format)
@@ -172,6 +486,7 @@ class Interface(_CRUDMixin, db.Model):
 class Download(_CRUDMixin, db.Model):
     __tablename__ = 'download'
     __caption__ = 'Download'
+    __derived__ = ('sha256', 'size')
 
     url = db.Column(
         db.String(128), nullable=False,
@@ -180,7 +495,12 @@ class Download(_CRUDMixin, db.Model):
         db.String(32), nullable=False,
         info={'label': 'Name'})
 
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'),
+                           index=True)
+
+    # Checksum and size of the mirrored copy, if any.
+    sha256 = db.Column(db.String(64))
+    size = db.Column(db.BigInteger)
 
     def __str__(self):
         return self.name
@@ -189,6 +509,8 @@ class Download(_CRUDMixin, db.Model):
 class Project(_CRUDMixin, db.Model):
     __tablename__ = 'project'
     __caption__ = 'Project'
+    __markdown__ = ('desc', 'api_desc')
+    __sections__ = ('pubs', 'apps', 'apis', 'contact')
 
     name = db.Column(
         db.String(32), nullable=False,
@@ -202,20 +524,287 @@ class Project(_CRUDMixin, db.Model):
     desc = db.Column(
         db.Text, nullable=False,
         info={'label': 'Description'})
+    desc_html = db.Column(db.Text)
+    desc_hash = db.Column(db.String(40))
     api_desc = db.Column(
         db.Text, nullable=False,
         info={'label': 'API Description'})
+    api_desc_html = db.Column(db.Text)
+    api_desc_hash = db.Column(db.String(40))
     github_url = db.Column(
         db.String(128),
         info={'label': 'GitHub URL'})
     update_date = db.Column(
         db.DateTime, nullable=False,
+        default=datetime.utcnow,
         server_default=db.func.now(),
-        onupdate=datetime.now)
+        onupdate=datetime.utcnow)
+
+    pubs_version = db.Column(db.Integer, default=0)
+    apps_version = db.Column(db.Integer, default=0)
+    apis_version = db.Column(db.Integer, default=0)
+    contact_version = db.Column(db.Integer, default=0)
 
-    pubs = db.relationship('Publication', lazy='dynamic')
-    apps = db.relationship('Application', lazy='dynamic')
-    apis = db.relationship('Interface', lazy='dynamic')
-    downloads = db.relationship('Download', lazy='dynamic')
+    pubs = db.relationship('Publication')
+    apps = db.relationship('Application')
+    apis = db.relationship('Interface')
+    downloads = db.relationship('Download')
     managers = db.relationship('User', secondary=project_managers,
-                               backref='projects', lazy='dynamic')
+                               backref='projects')
+
+    @classmethod
+    def graph_query(cls, sections=None):
+        '''Returns a query loading projects together with all their items.
+
+        Every relationship is loaded up front with one query each, so
+        rendering a project costs the same number of queries no matter how
+        many items it has. If ``sections`` is given, only the items of
+        those sections are loaded, besides downloads and managers.
+        '''
+        if sections is None:
+            sections = cls.__sections__
+
+        options = [db.subqueryload(cls.downloads),
+                   db.subqueryload(cls.managers)]
+        if 'pubs' in sections:
+            options.append(db.subqueryload(cls.pubs))
+        if 'apps' in sections:
+            options.append(db.subqueryload(cls.apps))
+        if 'apis' in sections:
+            options.append(
+                db.subqueryload(cls.apis).subqueryload(Interface.params))
+        return cls.query.options(*options)
+
+    def section_version(self, section):
+        return getattr(self, section + '_version') or 0
+
+    def touch(self, commit=True):
+        self.update_date = datetime.utcnow()
+        return self.save(commit)
+
+
+class _NavItems(list):
+    '''Projects of the navigation bar, with the time it last changed.'''
+
+    changed_at = None
+
+
+def _get_nav_items():
+    items = _NavItems(Project.query.with_entities(Project.short_name,
+                                                  Project.name))
+    items.changed_at = db.session.query(cache_versions.c.changed_at) \
+        .filter(cache_versions.c.name == 'nav').scalar()
+    return items
+
+
+def _get_project_choices():
+    return Project.query.with_entities(Project.id, Project.name) \
+        .order_by(Project.id).all()
+
+
+nav_cache = VersionedValue(_get_nav_items, lambda: get_cache_version('nav'))
+
+# Options of the projects field of user forms. Names only change along
+# with the navigation bar, so they share its version.
+project_choices = VersionedValue(_get_project_choices,
+                                 lambda: get_cache_version('nav'))
+
+
+@event.listens_for(Project, 'after_insert')
+@event.listens_for(Project, 'after_delete')
+def _bump_nav_version(mapper, connection, target):
+    bump_cache_version('nav', connection)
+    nav_cache.invalidate()
+    project_choices.invalidate()
+
+
+@event.listens_for(Project, 'after_update')
+def _bump_nav_version_on_rename(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if attrs.name.history.has_changes() or \
+       attrs.short_name.history.has_changes():
+        _bump_nav_version(mapper, connection, target)
+
+
+@event.listens_for(Download, 'before_update')
+def _forget_mirrored_copy(mapper, connection, target):
+    # The mirrored copy is of the old URL.
+    if inspect(target).attrs.url.history.has_changes():
+        target.sha256 = None
+        target.size = None
+
+
+def _next_version(section):
+    # Incremented in SQL, so bumps by other statements are never lost.
+    column = Project.__table__.c[section + '_version']
+    return db.func.coalesce(column, 0) + 1
+
+
+@event.listens_for(Project, 'before_update')
+def _bump_apis_version(mapper, connection, target):
+    # The API section starts with the project's API description.
+    if inspect(target).attrs.api_desc.history.has_changes():
+        target.apis_version = _next_version('apis')
+
+
+def _project_changes(section=None):
+    values = {'update_date': datetime.utcnow()}
+    if section is not None:
+        values[section + '_version'] = _next_version(section)
+    return values
+
+
+def _touch_project(project_id, connection, section=None):
+    project = Project.__table__
+    connection.execute(project.update()
+                       .where(project.c.id == project_id)
+                       .values(**_project_changes(section)))
+
+
+# The section of the project page showing each kind of item; downloads
+# are shown in the page header instead.
+_ITEM_SECTIONS = {
+    Publication: 'pubs',
+    Application: 'apps',
+    Interface: 'apis',
+    Parameter: 'apis'
+}
+
+
+@event.listens_for(Publication, 'after_insert')
+@event.listens_for(Publication, 'after_update')
+@event.listens_for(Publication, 'after_delete')
+@event.listens_for(Application, 'after_insert')
+@event.listens_for(Application, 'after_update')
+@event.listens_for(Application, 'after_delete')
+@event.listens_for(Interface, 'after_insert')
+@event.listens_for(Interface, 'after_update')
+@event.listens_for(Interface, 'after_delete')
+@event.listens_for(Download, 'after_insert')
+@event.listens_for(Download, 'after_update')
+@event.listens_for(Download, 'after_delete')
+def _touch_item_project(mapper, connection, target):
+    # Project.update_date versions the whole project graph, and the
+    # section version the part of the page showing the item.
+    _touch_project(target.project_id, connection,
+                   _ITEM_SECTIONS.get(mapper.class_))
+
+
+@event.listens_for(Parameter, 'after_insert')
+@event.listens_for(Parameter, 'after_update')
+@event.listens_for(Parameter, 'after_delete')
+def _touch_param_project(mapper, connection, target):
+    interface = Interface.__table__
+    _touch_project(db.select([interface.c.project_id])
+                   .where(interface.c.id == target.api_id).as_scalar(),
+                   connection, 'apis')
+
+
+def _bump_contact_versions(user_ids, connection):
+    project = Project.__table__
+    managed = db.select([project_managers.c.project_id]) \
+        .where(project_managers.c.user_id.in_(user_ids))
+    connection.execute(project.update()
+                       .where(project.c.id.in_(managed))
+                       .values(**_project_changes('contact')))
+
+
+@event.listens_for(User, 'after_update')
+def _bump_contact_on_user_change(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if attrs.name.history.has_changes() or \
+       attrs.email.history.has_changes():
+        _bump_contact_versions([target.id], connection)
+
+
+@event.listens_for(User, 'before_delete')
+def _bump_contact_on_user_delete(mapper, connection, target):
+    _bump_contact_versions([target.id], connection)
+
+
+def _expire_user_snapshots(session, user_ids):
+    # Dropped now and again after the commit, since a request in between
+    # may cache the rows as they were before it.
+    for user_id in user_ids:
+        user_cache.delete(user_id)
+    if session is not None:
+        session.info.setdefault('expired_users', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _expire_committed_user_snapshots(session):
+    for user_id in session.info.pop('expired_users', ()):
+        user_cache.delete(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_user_snapshots(session):
+    session.info.pop('expired_users', None)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _expire_user_snapshot(mapper, connection, target):
+    _expire_user_snapshots(object_session(target), [target.id])
+
+
+@event.listens_for(Project.managers, 'append')
+@event.listens_for(Project.managers, 'remove')
+def _expire_manager_snapshot(target, value, initiator):
+    if value.id is not None:
+        _expire_user_snapshots(
+            object_session(target) or object_session(value), [value.id])
+    if inspect(target).has_identity:
+        target.contact_version = _next_version('contact')
+
+
+# Functions called as ``listener(Model, where, deleted)`` after a bulk
+# statement, since mapper events do not fire for those: ``where`` selects
+# the rows inserted or updated, ``deleted`` lists the ids deleted.
+bulk_listeners = []
+
+
+def _notify_bulk(Model, where=None, deleted=None):
+    for listener in bulk_listeners:
+        listener(Model, where, deleted)
+
+
+def _bulk_changed(Model, ids=None, rows=None):
+    '''Does for a bulk statement what the mapper events do for each row.'''
+    if Model is User:
+        user_cache.clear()
+        _expire_user_snapshots(db.session(), ids or ())
+        for chunk in _chunks(ids or ()):
+            _bump_contact_versions(chunk, db.session)
+        return
+
+    if Model is Project:
+        bump_cache_version('nav')
+        nav_cache.invalidate()
+        project_choices.invalidate()
+        project = Project.__table__
+        for chunk in _chunks(ids or ()):
+            db.session.execute(project.update()
+                               .where(project.c.id.in_(chunk))
+                               .values(apis_version=_next_version('apis')))
+        return
+
+    table = Model.__table__
+    parent = 'api_id' if Model is Parameter else 'project_id'
+    if rows is not None:
+        keys = list(_chunks(set(row[parent] for row in rows
+                                if row.get(parent) is not None)))
+    else:
+        keys = [db.select([table.c[parent]]).where(table.c.id.in_(chunk))
+                for chunk in _chunks(ids)]
+
+    interface = Interface.__table__
+    for key in keys:
+        if Model is Parameter:
+            key = db.select([interface.c.project_id]) \
+                .where(interface.c.id.in_(key))
+        project = Project.__table__
+        db.session.execute(project.update()
+                           .where(project.c.id.in_(key))
+                           .values(**_project_changes(
+                               _ITEM_SECTIONS.get(Model))))
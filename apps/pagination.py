@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+
+__all__ = ('KeysetPage', 'keyset_page', 'encode_cursor', 'decode_cursor')
+
+
+def encode_cursor(direction, value):
+    data = json.dumps([direction, value], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    '''Returns ``(direction, value)``; raises ``ValueError`` if invalid.'''
+    try:
+        direction, value = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if direction not in ('next', 'prev'):
+        raise ValueError('Invalid cursor')
+    return direction, value
+
+
+class KeysetPage(object):
+
+    def __init__(self, items, key, has_prev, has_next):
+        self.items = items
+        self.prev_cursor = None
+        self.next_cursor = None
+        if items and has_prev:
+            self.prev_cursor = encode_cursor('prev', key(items[0]))
+        if items and has_next:
+            self.next_cursor = encode_cursor('next', key(items[-1]))
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def keyset_page(query, column, cursor=None, per_page=50):
+    '''Returns a page of ``query`` ordered by the unique ``column``.
+
+    Pages seek past the key of the last (or before the first) row of the
+    previous page instead of using an offset, so each one reads only
+    ``per_page`` rows from the column's index however deep it is.
+    '''
+    direction, value = 'next', None
+    if cursor:
+        direction, value = decode_cursor(cursor)
+
+    if direction == 'next':
+        if value is not None:
+            query = query.filter(column > value)
+        items = query.order_by(column).limit(per_page + 1).all()
+        has_prev = value is not None
+        has_next = len(items) > per_page
+        items = items[:per_page]
+    else:
+        query = query.filter(column < value)
+        items = query.order_by(column.desc()).limit(per_page + 1).all()
+        has_prev = len(items) > per_page
+        has_next = True
+        items = items[:per_page][::-1]
+
+    return KeysetPage(items, lambda item: getattr(item, column.key),
+                      has_prev, has_next)
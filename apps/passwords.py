@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from passlib.context import CryptContext
+
+__all__ = ('PasswordHasher', 'passwords')
+
+
+class PasswordHasher(object):
+    '''Hashes and verifies passwords with settings taken from the config.
+
+    The first of ``PASSWORD_SCHEMES`` is used for new hashes, with
+    ``PASSWORD_ROUNDS`` rounds; hashes made with another scheme or fewer
+    rounds are reported for an update when they are verified. Hashes with
+    more rounds are kept, so an update never weakens them. With
+    ``PASSWORD_VERIFY_THREADS`` set, verification runs in a bounded thread
+    pool, so at most that many slow hashes run at once.
+    '''
+
+    def __init__(self, app=None):
+        self.context = CryptContext(schemes=['sha256_crypt'])
+        self.threads = 0
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        schemes = app.config.get('PASSWORD_SCHEMES', ['sha256_crypt'])
+        rounds = app.config.get('PASSWORD_ROUNDS')
+        threads = app.config.get('PASSWORD_VERIFY_THREADS', 0)
+
+        options = {}
+        if rounds is not None:
+            for option in ('default_rounds', 'min_rounds'):
+                options['{0}__{1}'.format(schemes[0], option)] = rounds
+        self.context = CryptContext(schemes=schemes, deprecated=schemes[1:],
+                                    **options)
+
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.close()
+        self._pool = None
+        self.threads = threads
+
+    def _get_pool(self):
+        # Created on first use, since a pool inherited from the process
+        # that forked this one has no threads left.
+        pid = os.getpid()
+        with self._lock:
+            if self._pool is None or self._pool_pid != pid:
+                self._pool = ThreadPool(self.threads)
+                self._pool_pid = pid
+            return self._pool
+
+    def encrypt(self, pwd):
+        return self.context.encrypt(pwd)
+
+    def verify_and_update(self, pwd, pwd_hash):
+        '''Returns whether ``pwd`` matches, and a new hash if it is due.'''
+        if not self.threads:
+            return self.context.verify_and_update(pwd, pwd_hash)
+        return self._get_pool().apply(self.context.verify_and_update,
+                                      (pwd, pwd_hash))
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+
+from flask import url_for
+from jinja2 import Markup, escape
+from sqlalchemy import (Table, Column, Integer, String, Text, MetaData,
+                        event, inspect, select, and_, or_, case, text)
+from sqlalchemy.exc import OperationalError
+
+from .jobs import job_queue
+from .models import (db, Project, Publication, Application, Interface,
+                     Parameter, bulk_listeners)
+
+__all__ = ('search_index', 'create_index', 'drop_index', 'index_items',
+           'unindex_items', 'reindex', 'search')
+
+# The index lives outside db.metadata: on SQLite it is an FTS5 virtual
+# table, which create_all cannot create. Elsewhere, or without FTS5, it is
+# a plain table searched with LIKE.
+search_index = Table(
+    'search_index', MetaData(),
+    Column('rowid', Integer, primary_key=True),
+    Column('kind', String(8)),
+    Column('item_id', Integer),
+    Column('project_id', Integer),
+    Column('title', Text),
+    Column('body', Text))
+
+_FTS_DDL = '''CREATE VIRTUAL TABLE search_index USING fts5(
+    kind UNINDEXED, item_id UNINDEXED, project_id UNINDEXED, title, body)'''
+
+# Title matches weigh ten times as much as body matches.
+_FTS_RANK = '''INSERT INTO search_index(search_index, rank)
+    VALUES ('rank', 'bm25(0, 0, 0, 10.0, 1.0)')'''
+
+# kind, model, title, body columns and the section a result links to.
+_KINDS = (
+    ('project', Project, lambda row: row.name,
+     ('short_name', 'short_desc', 'desc', 'api_desc'), ''),
+    ('pub', Publication, lambda row: row.title,
+     ('authors', 'publisher'), 'pubs'),
+    ('app', Application, lambda row: row.name, ('desc',), 'apps'),
+    ('api', Interface, lambda row: u'{0} {1}'.format(row.method, row.format),
+     ('desc', 'returns', 'example'), 'apis'),
+    ('param', Parameter, lambda row: row.name, ('desc',), 'apis')
+)
+
+_KIND_CODES = dict((Model, code) for code, (_, Model, _, _, _)
+                   in enumerate(_KINDS))
+
+_SECTIONS = dict((kind, section) for kind, _, _, _, section in _KINDS)
+
+_MODELS = dict((Model.__tablename__, Model) for _, Model, _, _, _ in _KINDS)
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+_BATCH_SIZE = 1000
+
+# Seconds a missing index is remembered for, so processes started before
+# ``manage.py reindex`` find it soon after without a query for each write.
+_MISSING_INDEX_TTL = 1
+
+# (index type, time looked up) by database URL.
+_index_types = {}
+
+
+def _rowid(Model, item_id):
+    # Unique per item, so an item's entry is found without a scan.
+    return item_id * len(_KINDS) + _KIND_CODES[Model]
+
+
+def _index_type(connection):
+    '''Returns 'fts' or 'like', or None if the index is not created yet.'''
+    url = str(connection.engine.url)
+    now = time.time()
+    cached = _index_types.get(url)
+    if cached is not None and (cached[0] is not None or
+                               now - cached[1] < _MISSING_INDEX_TTL):
+        return cached[0]
+
+    index_type = None
+    if search_index.exists(bind=connection):
+        index_type = 'like'
+        if connection.dialect.name == 'sqlite':
+            sql = connection.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'search_index'"
+            ).scalar()
+            if 'fts5' in sql.lower():
+                index_type = 'fts'
+    _index_types[url] = (index_type, now)
+    return index_type
+
+
+def create_index(connection):
+    if _index_type(connection) is not None:
+        return
+
+    _index_types.pop(str(connection.engine.url), None)
+    if connection.dialect.name == 'sqlite':
+        try:
+            connection.execute(_FTS_DDL)
+            connection.execute(_FTS_RANK)
+            return
+        except OperationalError:
+            pass  # SQLite built without FTS5
+    search_index.create(bind=connection)
+
+
+def drop_index(connection):
+    if _index_type(connection) is not None:
+        connection.execute('DROP TABLE search_index')
+    _index_types.pop(str(connection.engine.url), None)
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_index(target, connection, **kwargs):
+    create_index(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_index(target, connection, **kwargs):
+    drop_index(connection)
+
+
+def _select_items(Model):
+    table = Model.__table__
+    if Model is Project:
+        return select([table, table.c.id.label('project_id')])
+    if Model is Parameter:
+        interface = Interface.__table__
+        return select([table, interface.c.project_id]).select_from(
+            table.join(interface, table.c.api_id == interface.c.id))
+    return select([table])
+
+
+def _entry(Model, row):
+    kind, _, title, body_columns, _ = _KINDS[_KIND_CODES[Model]]
+    return {
+        'rowid': _rowid(Model, row.id),
+        'kind': kind,
+        'item_id': row.id,
+        'project_id': row.project_id,
+        'title': title(row),
+        'body': u'\n'.join(row[column] or u'' for column in body_columns)
+    }
+
+
+def unindex_items(Model, ids, connection):
+    if Model not in _KIND_CODES:
+        return
+
+    rowids = [_rowid(Model, id) for id in ids]
+    for i in range(0, len(rowids), 500):
+        connection.execute(search_index.delete().where(
+            search_index.c.rowid.in_(rowids[i:i + 500])))
+
+
+def index_items(Model, connection, where=None):
+    '''(Re)indexes the items of ``Model`` matching ``where``.'''
+    if Model not in _KIND_CODES:
+        return
+
+    table = Model.__table__
+    query = _select_items(Model).order_by(table.c.id).limit(_BATCH_SIZE)
+    if where is not None:
+        query = query.where(where)
+
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            query.where(table.c.id > last_id)).fetchall()
+        if not rows:
+            break
+
+        unindex_items(Model, [row.id for row in rows], connection)
+        connection.execute(search_index.insert(),
+                           [_entry(Model, row) for row in rows])
+        last_id = rows[-1].id
+
+
+def reindex(connection):
+    _index_types.pop(str(connection.engine.url), None)
+    drop_index(connection)
+    create_index(connection)
+    for _, Model, _, _, _ in _KINDS:
+        index_items(Model, connection)
+
+
+def _after_write(mapper, connection, target):
+    if _index_type(connection) is None:
+        return
+
+    Model = mapper.class_
+    if job_queue.enabled:
+        table = Model.__tablename__
+        job_queue.enqueue('index_item', {'table': table, 'id': target.id},
+                          key='search:{0}:{1}'.format(table, target.id),
+                          connection=connection)
+    else:
+        index_items(Model, connection, Model.__table__.c.id == target.id)
+
+
+@job_queue.task('index_item')
+def _index_item(table, id):
+    Model = _MODELS[table]
+    connection = db.session.connection()
+    if _index_type(connection) is not None:
+        index_items(Model, connection, Model.__table__.c.id == id)
+
+
+def _unindex_params(api_ids, connection, ids=()):
+    # Parameters of deleted APIs are left without one, so are not found
+    # by their search results any more.
+    parameter = Parameter.__table__
+    api_ids = list(api_ids)
+    ids = list(ids)
+    for i in range(0, len(api_ids), 500):
+        ids.extend(row[0] for row in connection.execute(
+            select([parameter.c.id])
+            .where(parameter.c.api_id.in_(api_ids[i:i + 500]))))
+    unindex_items(Parameter, ids, connection)
+
+
+def _after_delete(mapper, connection, target):
+    if _index_type(connection) is not None:
+        unindex_items(mapper.class_, [target.id], connection)
+        if mapper.class_ is Project:
+            connection.execute(search_index.delete().where(
+                search_index.c.project_id == target.id))
+        elif mapper.class_ is Interface:
+            # The flush already took the loaded parameters off the API.
+            loaded = inspect(target).dict.get('params', ())
+            _unindex_params([target.id], connection,
+                            [param.id for param in loaded])
+
+
+for _, _Model, _, _, _ in _KINDS:
+    event.listen(_Model, 'after_insert', _after_write)
+    event.listen(_Model, 'after_update', _after_write)
+    event.listen(_Model, 'after_delete', _after_delete)
+
+
+def _after_bulk(Model, where, deleted):
+    connection = db.session.connection()
+    if _index_type(connection) is None:
+        return
+
+    if deleted is not None:
+        unindex_items(Model, deleted, connection)
+        if Model is Interface:
+            _unindex_params(deleted, connection)
+    else:
+        index_items(Model, connection, where)
+
+
+bulk_listeners.append(_after_bulk)
+
+
+def _search_fts(connection, tokens, limit, offset):
+    # The page is ranked on the index alone and joined with projects
+    # afterwards; joining first doubles the cost of ranking every match.
+    query = u' '.join(u'"{0}"*'.format(token) for token in tokens)
+    return connection.execute(text(
+        u'''SELECT hits.kind, hits.title, hits.snippet,
+                   project.short_name, project.name AS project_name
+            FROM (SELECT kind, title, project_id, rank,
+                         snippet(search_index, 4, '\x02', '\x03', '...', 16)
+                             AS snippet
+                  FROM search_index
+                  WHERE search_index MATCH :query
+                  ORDER BY rank LIMIT :limit OFFSET :offset) AS hits
+            JOIN project ON project.id = hits.project_id
+            ORDER BY hits.rank'''),
+        query=query, limit=limit, offset=offset).fetchall()
+
+
+def _search_like(connection, tokens, limit, offset):
+    s = search_index
+    project = Project.__table__
+    clauses = []
+    title_clauses = []
+    for token in tokens:
+        pattern = u'%{0}%'.format(re.sub(r'([\\%_])', r'\\\1', token))
+        title_match = s.c.title.like(pattern, escape='\\')
+        clauses.append(or_(title_match, s.c.body.like(pattern, escape='\\')))
+        title_clauses.append(title_match)
+
+    query = select([s.c.kind, s.c.title, s.c.body.label('snippet'),
+                    project.c.short_name,
+                    project.c.name.label('project_name')]) \
+        .select_from(s.join(project, project.c.id == s.c.project_id)) \
+        .where(and_(*clauses)) \
+        .order_by(case([(and_(*title_clauses), 0)], else_=1), s.c.rowid) \
+        .limit(limit).offset(offset)
+    return connection.execute(query).fetchall()
+
+
+def _format_snippet(snippet):
+    snippet = escape(snippet or '')
+    return Markup(snippet.replace(u'\x02', Markup(u'<mark>'))
+                  .replace(u'\x03', Markup(u'</mark>')))
+
+
+def search(query, page=1, per_page=20):
+    '''Returns a page of results for ``query`` and whether more follow.'''
+    tokens = _TOKEN_PATTERN.findall(query)
+    if not tokens:
+        return [], False
+
+    connection = db.session.connection()
+    index_type = _index_type(connection)
+    if index_type is None:
+        return [], False
+
+    run = _search_fts if index_type == 'fts' else _search_like
+    rows = run(connection, tokens, per_page + 1, (page - 1) * per_page)
+
+    results = []
+    for row in rows[:per_page]:
+        snippet = row.snippet
+        if index_type == 'like':
+            snippet = snippet[:200]
+        section = _SECTIONS[row.kind]
+        results.append({
+            'kind': row.kind,
+            'title': row.title,
+            'snippet': _format_snippet(snippet),
+            'project': row.project_name,
+            'url': url_for('.show_project', project=row.short_name) +
+            ('#' + section if section else '')
+        })
+    return results, len(rows) > per_page
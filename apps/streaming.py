@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from HTMLMinifier.parser import Parser
+
+__all__ = ('StreamMinifier', 'minify_stream')
+
+
+class StreamMinifier(object):
+    '''Minifies HTML fed in pieces, returning output as soon as it is final.
+
+    The parser may still strip trailing spaces from the last text node it
+    wrote when a following block tag arrives, so that node and everything
+    after it are held back until more input (or ``close``) settles them.
+
+    HTMLMinifier has no public API for taking output before the end, so
+    this reads the parser's ``_buffer`` and ``_last_text_idx``; the version
+    is pinned in requirements.txt for that reason.
+    '''
+
+    def __init__(self, **kwargs):
+        self._parser = Parser(**kwargs)
+
+    def _drain(self, end):
+        buf = self._parser._buffer
+        html = ''.join(buf[:end])
+        del buf[:end]
+        if self._parser._last_text_idx >= 0:
+            self._parser._last_text_idx -= end
+        return html
+
+    def feed(self, html):
+        self._parser.feed(html)
+        end = self._parser._last_text_idx
+        if end < 0:
+            end = len(self._parser._buffer)
+        return self._drain(end)
+
+    def close(self):
+        self._parser.close()
+        html = self._drain(len(self._parser._buffer)).rstrip()
+        self._parser.reset()
+        return html
+
+
+def minify_stream(chunks, chunk_size=8192):
+    '''Minifies an iterable of HTML pieces, yielding chunks of output.
+
+    Input is batched up to ``chunk_size`` characters before being fed to
+    the parser, so memory use follows the chunk size, not the page size.
+    '''
+    minifier = StreamMinifier()
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= chunk_size:
+            html = minifier.feed(''.join(pending))
+            pending = []
+            pending_size = 0
+            if html:
+                yield html
+
+    html = minifier.feed(''.join(pending)) + minifier.close()
+    if html:
+        yield html
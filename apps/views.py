@@ -1,30 +1,176 @@
 # -*- coding: utf-8 -*-
 
-from flask import (Blueprint, request, url_for, redirect, abort, flash,
-                   render_template)
+import hashlib
+from functools import wraps
+
+from flask import (Blueprint, Response, request, url_for, redirect, abort,
+                   flash, current_app, stream_with_context, jsonify,
+                   make_response, template_rendered)
 from flask.ext.login import (current_user, login_user, logout_user,
                              login_required)
-from HTMLMinifier import minify
 
-from .forms import (SigninForm, UserForm, SignupForm, PublicationForm,
-                    ApplicationForm, ParameterForm, InterfaceForm,
-                    DownloadForm, ProjectForm)
-from .models import User, Project, Interface
+from .cache import page_cache, fragment_cache
+from .compression import compressor
+from .metrics import metrics
+from .mirror import mirror
+from .pagination import keyset_page
+from .streaming import minify_stream
+from .models import db, User, Project, Interface, Download, nav_cache
+from .search import search as search_items
 
 module = Blueprint('projects', __name__)
 
+_SECTIONS = [('pubs', 'Publications'),
+             ('apps', 'Applications'),
+             ('apis', 'Web APIs'),
+             ('contact', 'Contact Information')]
+
+# Names of the forms of project items in ``forms``.
 _FORMS = {
-    'pub': PublicationForm,
-    'app': ApplicationForm,
-    'api': InterfaceForm,
-    'param': ParameterForm,
-    'download': DownloadForm
+    'pub': 'PublicationForm',
+    'app': 'ApplicationForm',
+    'api': 'InterfaceForm',
+    'param': 'ParameterForm',
+    'download': 'DownloadForm'
 }
 
 
-def _render_template(*args, **kwargs):
-    html = render_template(*args, **kwargs)
-    return minify(html)
+def _get_form(name):
+    # WTForms-Alchemy is slow to import and builds every model form when
+    # loaded, so workers leave it until a request first needs a form.
+    from . import forms
+    return getattr(forms, name)
+
+
+try:
+    from flask import before_render_template
+except ImportError:
+    # Added in Flask 0.11.
+    before_render_template = None
+
+
+def _template_chunks(app, template, context):
+    # Sends the signals ``render_template`` would, once rendering ends.
+    if before_render_template is not None:
+        before_render_template.send(app, template=template, context=context)
+    for chunk in template.generate(context):
+        yield chunk
+    template_rendered.send(app, template=template, context=context)
+
+
+def _generate_template(template_name, **context):
+    current_app.update_template_context(context)
+    with metrics.timed('template'):
+        template = current_app.jinja_env.get_or_select_template(template_name)
+    chunk_size = current_app.config.get('STREAM_CHUNK_SIZE', 8192)
+    chunks = metrics.timed_iter('template', _template_chunks(
+        current_app._get_current_object(), template, context))
+    return metrics.timed_iter('minify', minify_stream(chunks, chunk_size))
+
+
+def _render_template(template_name, **context):
+    return ''.join(_generate_template(template_name, **context))
+
+
+def _stream_template(template_name, **context):
+    # The session is saved before a streamed body is sent, so only pages
+    # that neither show flashed messages nor embed CSRF tokens may stream.
+    if not current_app.config.get('STREAM_TEMPLATES', True):
+        return _render_template(template_name, **context)
+
+    chunks = _generate_template(template_name, **context)
+    return Response(stream_with_context(chunks))
+
+
+def _project_cache_key(project_id):
+    return 'project:{0}'.format(project_id)
+
+
+def _project_cache_version(update_date):
+    # Pages embed the navigation bar, so they depend on its version too.
+    nav_cache.get()
+    return '{0}:{1}'.format(update_date, nav_cache.version)
+
+
+def _page_last_modified(update_date):
+    # Pages embed the navigation bar, so they change along with it too.
+    changed_at = nav_cache.get().changed_at
+    if changed_at is None:
+        return update_date
+    return max(update_date, changed_at)
+
+
+def _project_sections(project_id, versions):
+    # (id, caption, fragment cache key, version) of each page section. The
+    # navigation version changes when projects are added or deleted, so a
+    # new project reusing a deleted one's id never gets its fragments.
+    nav_cache.get()
+    return [(id, caption,
+             '{0}:{1}'.format(_project_cache_key(project_id), id),
+             '{0}:{1}'.format(version or 0, nav_cache.version))
+            for (id, caption), version in zip(_SECTIONS, versions)]
+
+
+def _load_project(project_id, sections):
+    # Only the items of sections that are not cached are loaded.
+    missing = [id for id, _, key, version in sections
+               if fragment_cache.get(key, version) is None]
+    return Project.graph_query(missing).get(project_id)
+
+
+def _make_etag(*parts):
+    tag = ':'.join(str(part) for part in parts)
+    return hashlib.sha1(tag.encode('utf-8')).hexdigest()
+
+
+def _is_not_modified(etag, last_modified):
+    # ``last_modified`` is in UTC, like If-Modified-Since, and covers every
+    # input of the ETag.
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= \
+            request.if_modified_since
+    return False
+
+
+def _conditional_response(etag, last_modified, render):
+    '''Calls ``render`` unless the client already has this version.'''
+    if _is_not_modified(etag, last_modified):
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = \
+        current_app.config.get('HTTP_CACHE_MAX_AGE', 0)
+    return response
+
+
+def _public_page(etag, last_modified, render):
+    # Signed-in users see edit links and their own menu.
+    if current_user.is_authenticated():
+        response = make_response(render())
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response = _conditional_response(etag, last_modified, render)
+    response.vary.add('Cookie')
+    return response
+
+
+def _manager_required(view):
+    '''Passes the ``project`` to the view if the user may manage it.'''
+    @wraps(view)
+    def wrapper(project, **kwargs):
+        project = Project.query.filter_by(short_name=project).first_or_404()
+        if not current_user.can_manage(project):
+            return abort(403)
+        return view(project, **kwargs)
+    return wrapper
 
 
 def _create_project_item(Model, item_type, project):
@@ -66,9 +212,32 @@ def _get_page_after_action(item_type, project, item):
     return target
 
 
+def _list_page(query, column):
+    config = current_app.config
+    per_page = request.args.get('per_page', config['LIST_PAGE_SIZE'],
+                                type=int)
+    per_page = min(max(per_page, 1), config['LIST_MAX_PAGE_SIZE'])
+    try:
+        return keyset_page(query, column, request.args.get('cursor'),
+                           per_page)
+    except ValueError:
+        return abort(400)
+
+
 @module.route('/')
 def index():
-    return _render_template('index.html')
+    nav_cache.get()
+    etag = _make_etag('index', nav_cache.version)
+    return _public_page(etag, None, lambda: _stream_template('index.html'))
+
+
+@module.route('/search')
+def search():
+    query = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = search_items(query, page)
+    return _stream_template('search.html', query=query, page=page,
+                            results=results, has_next=has_next)
 
 
 @module.route('/projects')
@@ -77,31 +246,97 @@ def show_projects():
     if not current_user.is_admin:
         return abort(403)
 
-    return _render_template('list_projects.html')
+    projects = _list_page(
+        Project.query.with_entities(Project.short_name, Project.name),
+        Project.short_name)
+    return _stream_template('list_projects.html', projects=projects)
 
 
 @module.route('/project/<project>')
 def show_project(project):
-    project = Project.query.filter_by(short_name=project).first_or_404()
-    sections = [('pubs', 'Publications'),
-                ('apps', 'Applications'),
-                ('apis', 'Web APIs'),
-                ('contact', 'Contact Information')]
-    return _render_template('show_project.html',
-                            project=project, sections=sections)
+    row = Project.query \
+        .with_entities(Project.id, Project.update_date,
+                       *[getattr(Project, id + '_version')
+                         for id, _ in _SECTIONS]) \
+        .filter_by(short_name=project).first_or_404()
+    project_id, update_date = row[:2]
+    key = _project_cache_key(project_id)
+    version = _project_cache_version(update_date)
+    sections = _project_sections(project_id, row[2:])
+
+    def render():
+        if current_user.is_authenticated():
+            return _stream_template('show_project.html',
+                                    project=_load_project(project_id,
+                                                          sections),
+                                    sections=sections)
+
+        # Pages seen by anonymous visitors are identical, so they are
+        # served from the page cache as long as the project is unchanged.
+        html = page_cache.get(key, version)
+        if html is None:
+            html = _render_template('show_project.html',
+                                    project=_load_project(project_id,
+                                                          sections),
+                                    sections=sections)
+            html = page_cache.set(key, version, html)
+        compressor.cache_variants(page_cache, key, version)
+        return html
+
+    return _public_page(_make_etag(key, version),
+                        _page_last_modified(update_date), render)
+
+
+@module.route('/api/project/<project>')
+def show_project_json(project):
+    project_id, update_date = Project.query \
+        .with_entities(Project.id, Project.update_date) \
+        .filter_by(short_name=project).first_or_404()
+
+    def render():
+        project = Project.graph_query().get(project_id)
+        data = project.to_dict()
+        data['pubs'] = [pub.to_dict() for pub in project.pubs]
+        data['apps'] = [app.to_dict() for app in project.apps]
+        data['downloads'] = [download.to_dict()
+                             for download in project.downloads]
+        data['apis'] = []
+        for api in project.apis:
+            api_data = api.to_dict()
+            api_data['params'] = [param.to_dict() for param in api.params]
+            data['apis'].append(api_data)
+        data['managers'] = [manager.name for manager in project.managers]
+        return jsonify(data)
+
+    etag = _make_etag('api', _project_cache_key(project_id), update_date)
+    return _conditional_response(etag, update_date, render)
+
+
+@module.route('/download/<int:download_id>')
+def download(download_id):
+    url, sha256 = Download.query \
+        .with_entities(Download.url, Download.sha256) \
+        .filter_by(id=download_id).first_or_404()
+    if not mirror.has(sha256):
+        return redirect(url)
+    return mirror.send(sha256, url)
 
 
 @module.route('/project/<project>/edit', methods=['GET', 'POST'])
 @login_required
+@_manager_required
 def edit_project(project):
-    project = Project.query.filter_by(short_name=project).first_or_404()
-    if not current_user.is_admin and current_user not in project.managers:
-        return abort(403)
-
-    form = ProjectForm(request.form, obj=project)
+    form = _get_form('ProjectForm')(request.form, obj=project)
     if form.validate_on_submit():
+        nav_item = (project.short_name, project.name)
         form.populate_obj(project)
-        project.save()
+        project.touch()
+
+        # Every page embeds the navigation bar.
+        if nav_item != (project.short_name, project.name):
+            page_cache.clear()
+        else:
+            page_cache.delete(_project_cache_key(project.id))
 
         flash('Project infromation was successfully updated.')
         return redirect(url_for('.edit_project', project=project.short_name))
@@ -122,10 +357,11 @@ def create_project():
         return abort(403)
 
     project = Project()
-    form = ProjectForm(request.form, obj=project)
+    form = _get_form('ProjectForm')(request.form, obj=project)
     if form.validate_on_submit():
         form.populate_obj(project)
         project.save()
+        page_cache.clear()
 
         flash('Project was successfully created.')
         return redirect(url_for('.edit_project', project=project.short_name))
@@ -137,15 +373,12 @@ def create_project():
 
 @module.route('/project/<project>/edit/<item_type>', methods=['GET', 'POST'])
 @login_required
+@_manager_required
 def edit_item(project, item_type):
-    project = Project.query.filter_by(short_name=project).first_or_404()
-    Form = _FORMS.get(item_type)
-    if Form is None:
+    if item_type not in _FORMS:
         return abort(404)
 
-    if not current_user.is_admin and current_user not in project.managers:
-        return abort(403)
-
+    Form = _get_form(_FORMS[item_type])
     Model = Form.Meta.model
     item_id = request.args.get('id')
     if item_id is None:
@@ -159,6 +392,7 @@ def edit_item(project, item_type):
     if form.validate_on_submit():
         form.populate_obj(item)
         item.save()
+        page_cache.delete(_project_cache_key(project.id))
 
         flash('{0} was successfully updated.'.format(Model.__caption__))
         target = _get_page_after_action(item_type, project, item)
@@ -175,23 +409,20 @@ def edit_item(project, item_type):
 
 @module.route('/project/<project>/delete/<item_type>')
 @login_required
+@_manager_required
 def delete_item(project, item_type):
-    project = Project.query.filter_by(short_name=project).first_or_404()
-    if not current_user.is_admin and current_user not in project.managers:
-        return abort(403)
-
     item_id = request.args.get('id')
-    if item_id is None:
+    if item_id is None or item_type not in _FORMS:
         return abort(404)
 
-    Form = _FORMS.get(item_type)
-    Model = Form.Meta.model
+    Model = _get_form(_FORMS[item_type]).Meta.model
     item = _get_project_item(Model, item_type, project, item_id)
     if item is None:
         return abort(404)
 
     if request.args.get('confirmed'):
         item.delete()
+        page_cache.delete(_project_cache_key(project.id))
 
         flash('{0} was successfully deleted.'.format(Model.__caption__))
         target = _get_page_after_action(item_type, project, item)
@@ -207,7 +438,12 @@ def show_users():
     if not current_user.is_admin:
         return abort(403)
 
-    return _render_template('list_users.html', users=User.query.all())
+    sort = User.id if request.args.get('sort') == 'id' else User.email
+    users = _list_page(
+        User.query.with_entities(User.id, User.name, User.email,
+                                 User.is_admin),
+        sort)
+    return _stream_template('list_users.html', users=users, sort=sort.key)
 
 
 @module.route('/user/<int:user_id>/edit', methods=['GET', 'POST'])
@@ -220,7 +456,7 @@ def edit_user(user_id):
     if user is None:
         return abort(404)
 
-    form = UserForm(request.form, obj=user)
+    form = _get_form('UserForm')(request.form, obj=user)
     if form.validate_on_submit():
         if not current_user.is_admin:
             form.projects.data = user.projects
@@ -228,8 +464,15 @@ def edit_user(user_id):
         elif current_user.id == user_id:
             form.is_admin.data = True
 
+        # The contact section of each managed project lists the user.
+        projects = set(user.projects)
         form.populate_obj(user)
-        user.save()
+        projects.update(user.projects)
+        user.save(commit=False)
+        for project in projects:
+            project.touch(commit=False)
+            page_cache.delete(_project_cache_key(project.id))
+        db.session.commit()
 
         flash('User information was successfully updated.')
         return _render_template('edit_user.html', form=form)
@@ -244,10 +487,14 @@ def create_user():
         return abort(403)
 
     user = User()
-    form = SignupForm(request.form, obj=user)
+    form = _get_form('SignupForm')(request.form, obj=user)
     if form.validate_on_submit():
         form.populate_obj(user)
-        user.save()
+        user.save(commit=False)
+        for project in user.projects:
+            project.touch(commit=False)
+            page_cache.delete(_project_cache_key(project.id))
+        db.session.commit()
         return redirect(url_for('.show_users'))
 
     return _render_template('edit_user.html', form=form)
@@ -258,7 +505,7 @@ def signin():
     if current_user is not None and current_user.is_authenticated():
         return redirect(url_for('.index'))
 
-    form = SigninForm(request.form)
+    form = _get_form('SigninForm')(request.form)
     if form.validate_on_submit():
         login_user(form.user, remember=form.remember.data)
         return redirect(request.args.get('next') or url_for('.index'))
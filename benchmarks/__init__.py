@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks for the site, run from the repository root as
+``python -m benchmarks.<name>``. Each one prints its results as JSON.
+'''
+
+from __future__ import division, print_function
+
+import json
+import resource
+from datetime import date
+
+from apps import create_app
+from apps.models import (db, Project, Publication, Interface, Parameter,
+                         Download)
+
+__all__ = ('create_bench_app', 'seed_project', 'peak_rss_kb', 'percentile',
+           'report')
+
+_API_DESC = '''Looks up **concepts** related to the given term.
+
+* Results are sorted by score.
+* At most `limit` results are returned.
+'''
+
+_API_EXAMPLE = '''    GET /api/concept/dog?limit=2
+
+    [{"concept": "animal", "score": 0.9}, {"concept": "pet", "score": 0.8}]
+'''
+
+
+def create_bench_app(db_path, create_db=False, profile=None, **config):
+    options = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+        'SQLALCHEMY_ECHO': False,
+        'PAGE_CACHE_TYPE': 'null',
+        'WTF_CSRF_ENABLED': False
+    }
+    options.update(config)
+    return create_app(create_db=create_db, config=options, profile=profile)
+
+
+def seed_project(short_name, pubs=10, apis=100, params=5, downloads=2):
+    project = Project.create(
+        name=short_name.upper(), short_name=short_name,
+        short_desc='Synthetic project {0}'.format(short_name),
+        desc='# {0}\n\n{1}'.format(short_name, _API_DESC * 5),
+        api_desc=_API_DESC)
+
+    for i in range(pubs):
+        db.session.add(Publication(
+            title='Publication {0}'.format(i), authors='A. Author, B. Author',
+            publisher='Proceedings of Benchmarks', date=date(2014, 1, 1),
+            project_id=project.id))
+
+    for i in range(downloads):
+        db.session.add(Download(
+            name='Dump {0}'.format(i),
+            url='http://example.com/{0}/{1}.tar.gz'.format(short_name, i),
+            project_id=project.id))
+
+    for i in range(apis):
+        api = Interface(
+            method='GET', format='/api/{0}/<term>'.format(i),
+            desc=_API_DESC, returns='A JSON list of `{concept, score}`.',
+            example=_API_EXAMPLE, project_id=project.id).save(commit=False)
+        db.session.flush()
+        for j in range(params):
+            Parameter(name='param{0}'.format(j), desc=_API_DESC,
+                      api_id=api.id).save(commit=False)
+
+    db.session.commit()
+    return project
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def report(results):
+    print(json.dumps(results, indent=2, sort_keys=True))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+'''Measures bytes on the wire and CPU time per request for a large project
+page at different compression levels, against a seeded temporary
+database.
+
+For each level the compression alone is timed on the page body, then the
+page is requested by an anonymous client with the page cache on (so the
+compressed copy is served from the cache) and off (so every request is
+rendered and compressed again).
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from apps.compression import brotli, compress
+from . import create_bench_app, seed_project, report
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _levels():
+    '''Returns ``(name, encoding, level)`` tuples.'''
+    levels = [('identity', None, None)]
+    levels.extend(('gzip-{0}'.format(level), 'gzip', level)
+                  for level in (1, 6, 9))
+    if brotli is not None:
+        levels.extend(('br-{0}'.format(quality), 'br', quality)
+                      for quality in (1, 5, 9, 11))
+    return levels
+
+
+def _time_compress(body, encoding, level, count):
+    start = _cpu_time()
+    for _ in range(count):
+        compress(body, encoding, level)
+    return (_cpu_time() - start) / count * 1000
+
+
+def _time_requests(db_path, encoding, level, cache_type, count):
+    app = create_bench_app(db_path, PAGE_CACHE_TYPE=cache_type,
+                           COMPRESS=encoding is not None,
+                           COMPRESS_LEVEL=level, COMPRESS_BR_QUALITY=level)
+    client = app.test_client()
+    headers = {}
+    if encoding is not None:
+        headers['Accept-Encoding'] = encoding
+    # The first request fills the page cache.
+    response = client.get('/project/bench', headers=headers)
+    assert response.headers.get('Content-Encoding') == encoding
+
+    start = _cpu_time()
+    for _ in range(count):
+        client.get('/project/bench', headers=headers)
+    return len(response.data), (_cpu_time() - start) / count * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--apis', type=int, default=300)
+    parser.add_argument('--params', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmpdir, 'bench.db')
+        app = create_bench_app(db_path, create_db=True, COMPRESS=False)
+        with app.app_context():
+            seed_project('bench', apis=args.apis, params=args.params)
+        body = app.test_client().get('/project/bench').data
+
+        results = {'config': vars(args), 'page_bytes': len(body)}
+        for name, encoding, level in _levels():
+            result = {}
+            if encoding is not None:
+                result['compress_cpu_ms'] = _time_compress(
+                    body, encoding, level, args.requests)
+            for cache_type in ('memory', 'null'):
+                size, cpu_ms = _time_requests(db_path, encoding, level,
+                                              cache_type, args.requests)
+                result['wire_bytes'] = size
+                result['ratio'] = len(body) / size
+                result['request_cpu_ms_page_cache_' + cache_type] = cpu_ms
+            results[name] = result
+        report(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+'''Compares rows per second of per-row CRUD calls, unit_of_work() and the
+bulk_* class methods, creating, updating and deleting publications.
+'''
+
+from __future__ import division
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
+
+from apps.models import Publication, unit_of_work
+from . import create_bench_app, seed_project, report
+
+
+def _rows(project_id, count, suffix=''):
+    return [{'title': 'Publication {0}{1}'.format(i, suffix),
+             'authors': 'A. Author', 'publisher': 'Benchmarks',
+             'date': date(2014, 1, 1), 'project_id': project_id}
+            for i in range(count)]
+
+
+def _per_row(project_id, count):
+    for row in _rows(project_id, count):
+        Publication.create(**row)
+    for pub in Publication.query.all():
+        pub.update(title=pub.title + ' (updated)')
+    for pub in Publication.query.all():
+        pub.delete()
+
+
+def _unit_of_work(project_id, count):
+    with unit_of_work():
+        for row in _rows(project_id, count):
+            Publication.create(**row)
+    with unit_of_work():
+        for pub in Publication.query.all():
+            pub.update(title=pub.title + ' (updated)')
+    with unit_of_work():
+        for pub in Publication.query.all():
+            pub.delete()
+
+
+def _bulk(project_id, count):
+    Publication.bulk_create(_rows(project_id, count))
+    ids = [id for id, in Publication.query.with_entities(Publication.id)]
+    Publication.bulk_update([{'id': id, 'title': 'Updated {0}'.format(id)}
+                             for id in ids])
+    Publication.bulk_delete(ids)
+
+
+_MODES = (('per_row', _per_row), ('unit_of_work', _unit_of_work),
+          ('bulk', _bulk))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        app = create_bench_app(os.path.join(tmpdir, 'bench.db'),
+                               create_db=True)
+        results = {'rows': args.rows}
+        with app.app_context():
+            project_id = seed_project('bench', pubs=0, apis=0).id
+            for name, run in _MODES:
+                start = time.time()
+                run(project_id, args.rows)
+                elapsed = time.time() - start
+                assert Publication.query.count() == 0
+                # create, update and delete each touch every row once.
+                results[name] = {
+                    'seconds': elapsed,
+                    'rows_per_second': 3 * args.rows / elapsed
+                }
+        report(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+'''Times building, validating and rendering the admin edit forms, as
+``edit_item``, ``edit_project`` and ``edit_user`` do on a submitted form,
+against a seeded temporary database.
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from apps.forms import UserForm, ProjectForm, InterfaceForm
+from apps.models import db, QueryCounter, User, Project, Interface
+from . import create_bench_app, seed_project, percentile, report
+
+
+def _cases(user, project, api, project_ids):
+    '''Returns ``(name, Form, obj, data)`` tuples.'''
+    return [
+        ('user', UserForm, user,
+         {'name': user.name, 'email': user.email, 'is_admin': 'y',
+          'projects': [str(id) for id in project_ids[:3]]}),
+        ('project', ProjectForm, project,
+         {'name': project.name, 'short_name': project.short_name,
+          'short_desc': project.short_desc, 'desc': project.desc,
+          'api_desc': project.api_desc,
+          'github_url': 'https://github.com/example/bench0'}),
+        ('api', InterfaceForm, api,
+         {'method': api.method, 'format': api.format, 'desc': api.desc,
+          'returns': api.returns, 'example': api.example})
+    ]
+
+
+def _time_case(app, Form, obj, data, count):
+    timings = {'build': [], 'validate': [], 'render': []}
+    with QueryCounter() as counter:
+        for _ in range(count):
+            with app.test_request_context(method='POST', data=data):
+                obj = db.session.merge(obj, load=False)
+                start = time.time()
+                form = Form(obj=obj)
+                built = time.time()
+                valid = form.validate()
+                validated = time.time()
+                for field in form:
+                    field()
+                rendered = time.time()
+                assert valid, form.errors
+
+            timings['build'].append(built - start)
+            timings['validate'].append(validated - built)
+            timings['render'].append(rendered - validated)
+
+    summary = {'queries_per_form': counter.count / count}
+    for step, values in timings.items():
+        summary[step + '_p50_ms'] = percentile(values, 50) * 1000
+        summary[step + '_p95_ms'] = percentile(values, 95) * 1000
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--projects', type=int, default=50)
+    parser.add_argument('--forms', type=int, default=200)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        app = create_bench_app(os.path.join(tmpdir, 'bench.db'),
+                               create_db=True)
+        with app.app_context():
+            for i in range(args.projects):
+                seed_project('bench{0}'.format(i), pubs=1, apis=1, params=1,
+                             downloads=0)
+            user = User(email='admin@example.com', name='Admin',
+                        is_admin=True)
+            user.set_pwd('admin')
+            user.save()
+            project = Project.query.first()
+            cases = _cases(user, project, Interface.query.first(),
+                           [id for id, in db.session.query(Project.id)])
+
+            results = {'config': vars(args)}
+            for name, Form, obj, data in cases:
+                results[name] = _time_case(app, Form, obj, data, args.forms)
+        report(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+'''Measures sign-ins per second through /signin for several hash settings.'''
+
+from __future__ import division
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from apps.models import User
+from . import create_bench_app, report
+
+
+def _sign_in(app, count):
+    for _ in range(count):
+        response = app.test_client().post(
+            '/signin', data={'email': 'bench@example.com', 'pwd': 'bench'})
+        assert response.status_code == 302, response.status_code
+
+
+def _run_setting(db_path, rounds, threads, clients, count):
+    app = create_bench_app(db_path, PASSWORD_ROUNDS=rounds,
+                           PASSWORD_VERIFY_THREADS=threads)
+    with app.app_context():
+        user = User.query.filter_by(email='bench@example.com').one()
+        user.set_pwd('bench')
+        user.save()
+
+    workers = [threading.Thread(target=_sign_in, args=(app, count))
+               for _ in range(clients)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    return {
+        'rounds': rounds,
+        'verify_threads': threads,
+        'clients': clients,
+        'sign_ins': clients * count,
+        'sign_ins_per_second': clients * count / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, nargs='+',
+                        default=[5000, 20000, 110000, 535000])
+    parser.add_argument('--threads', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--count', type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmpdir, 'bench.db')
+        app = create_bench_app(db_path, create_db=True)
+        with app.app_context():
+            user = User(email='bench@example.com', name='Bench',
+                        is_admin=False)
+            user.set_pwd('bench')
+            user.save()
+
+        report([_run_setting(db_path, rounds, threads, args.clients,
+                             args.count)
+                for rounds in args.rounds for threads in args.threads])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
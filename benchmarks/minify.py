@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+'''Compares post-hoc and streaming minification of a large project page.
+
+Each mode runs in its own process so that peak RSS is measured in
+isolation.
+'''
+
+from __future__ import division
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from flask import render_template
+from HTMLMinifier import minify
+
+from apps.models import Project
+from apps.views import _generate_template
+from . import create_bench_app, seed_project, peak_rss_kb, report
+
+_MODES = ('buffer', 'stream')
+
+_SECTIONS = [('pubs', 'Publications'),
+             ('apps', 'Applications'),
+             ('apis', 'Web APIs'),
+             ('contact', 'Contact Information')]
+
+
+def _render_buffer(project):
+    html = minify(render_template('show_project.html', project=project,
+                                  sections=_SECTIONS))
+    return len(html.encode('utf-8'))
+
+
+def _render_stream(project):
+    size = 0
+    for chunk in _generate_template('show_project.html', project=project,
+                                    sections=_SECTIONS):
+        size += len(chunk.encode('utf-8'))
+    return size
+
+
+def _run_mode(db_path, mode, repeat):
+    app = create_bench_app(db_path)
+    render = _render_buffer if mode == 'buffer' else _render_stream
+    with app.test_request_context('/project/bench'):
+        project = Project.graph_query().filter_by(short_name='bench').one()
+        rss_before = peak_rss_kb()
+
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            size = render(project)
+            timings.append(time.time() - start)
+
+    timings.sort()
+    return {
+        'bytes': size,
+        'latency_ms_min': timings[0] * 1000,
+        'latency_ms_median': timings[len(timings) // 2] * 1000,
+        'peak_rss_kb': peak_rss_kb(),
+        'peak_rss_growth_kb': peak_rss_kb() - rss_before
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--apis', type=int, default=300)
+    parser.add_argument('--params', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--mode', choices=_MODES)
+    parser.add_argument('--db')
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(_run_mode(args.db, args.mode, args.repeat)))
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmpdir, 'bench.db')
+        app = create_bench_app(db_path, create_db=True)
+        with app.app_context():
+            seed_project('bench', apis=args.apis, params=args.params)
+
+        results = {'apis': args.apis, 'params': args.params}
+        for mode in _MODES:
+            output = subprocess.check_output([
+                sys.executable, '-m', 'benchmarks.minify', '--mode', mode,
+                '--db', db_path, '--repeat', str(args.repeat)])
+            results[mode] = json.loads(output.decode('utf-8'))
+        report(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
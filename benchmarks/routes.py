@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+'''Drives the main routes against a seeded temporary database and reports
+latency percentiles, requests per second, queries per request and peak
+memory.
+
+Each route is first requested one at a time through the test client,
+then all of them are mixed by ``--threads`` concurrent clients over HTTP
+against a threaded local server. With ``--baseline`` the run is compared
+to an earlier report and exits with status 1 if the p95 latency of any
+route got worse by more than ``--tolerance``.
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import cookielib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from apps.models import QueryCounter, User, Interface, Publication
+from . import create_bench_app, seed_project, peak_rss_kb, percentile, report
+
+_ADMIN = {'email': 'admin@example.com', 'pwd': 'admin'}
+
+
+def _routes(api_id, pub_id):
+    '''Returns ``(name, method, path, data, signed_in)`` tuples.'''
+    pub = {'title': 'Updated publication', 'authors': 'A. Author',
+           'publisher': 'Benchmarks', 'date': '2014-01-01'}
+    return [
+        ('index', 'GET', '/', None, False),
+        ('show_project', 'GET', '/project/bench0', None, False),
+        ('show_project_signed_in', 'GET', '/project/bench0', None, True),
+        ('edit_item_get', 'GET',
+         '/project/bench0/edit/api?id={0}'.format(api_id), None, True),
+        ('edit_item_post', 'POST',
+         '/project/bench0/edit/pub?id={0}'.format(pub_id), pub, True),
+        ('signin', 'POST', '/signin', _ADMIN, False)
+    ]
+
+
+def _summarize(latencies, seconds, queries=None):
+    summary = {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / seconds if seconds else None,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+    if queries is not None:
+        summary['queries_per_request'] = queries / len(latencies)
+    return summary
+
+
+def _run_sequential(app, routes, count):
+    results = {}
+    for name, method, path, data, signed_in in routes:
+        client = app.test_client()
+        if signed_in:
+            client.post('/signin', data=_ADMIN)
+
+        latencies = []
+        with QueryCounter() as counter:
+            start = time.time()
+            for _ in range(count):
+                if name == 'signin':
+                    client = app.test_client()
+                request_start = time.time()
+                response = client.open(path, method=method, data=data,
+                                       buffered=True)
+                latencies.append(time.time() - request_start)
+                assert response.status_code in (200, 302), \
+                    (name, response.status_code)
+            elapsed = time.time() - start
+        results[name] = _summarize(latencies, elapsed, counter.count)
+    return results
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class _NoRedirectHandler(urllib2.HTTPRedirectHandler):
+    # A redirect ends the request, as it does in the test client.
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _load_client(base_url, routes, stop, results):
+    opener = urllib2.build_opener(
+        urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+    opener.open(base_url + '/signin', urllib.urlencode(_ADMIN)).read()
+    anonymous = urllib2.build_opener(_NoRedirectHandler)
+    opener.add_handler(_NoRedirectHandler())
+
+    latencies = dict((route[0], []) for route in routes)
+    errors = 0
+    while not stop.is_set():
+        for name, method, path, data, signed_in in routes:
+            client = opener if signed_in else anonymous
+            body = urllib.urlencode(data) if method == 'POST' else None
+            start = time.time()
+            try:
+                client.open(base_url + path, body).read()
+            except urllib2.HTTPError as e:
+                if e.code != 302:
+                    errors += 1
+                    continue
+            except Exception:
+                errors += 1
+                continue
+            latencies[name].append(time.time() - start)
+    results.append((latencies, errors))
+
+
+def _run_load(app, routes, threads, seconds):
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=_QuietHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    base_url = 'http://127.0.0.1:{0}'.format(server.server_port)
+
+    stop = threading.Event()
+    results = []
+    clients = [threading.Thread(target=_load_client,
+                                args=(base_url, routes, stop, results))
+               for _ in range(threads)]
+    for client in clients:
+        client.start()
+    time.sleep(seconds)
+    stop.set()
+    for client in clients:
+        client.join()
+    server.shutdown()
+
+    latencies = dict((route[0], []) for route in routes)
+    errors = 0
+    for client_latencies, client_errors in results:
+        for name, values in client_latencies.items():
+            latencies[name].extend(values)
+        errors += client_errors
+
+    summary = dict((name, _summarize(values, seconds))
+                   for name, values in latencies.items() if values)
+    summary['total_requests_per_second'] = \
+        sum(len(values) for values in latencies.values()) / seconds
+    summary['errors'] = errors
+    return summary
+
+
+def _regressions(results, baseline, tolerance):
+    regressions = []
+    for mode in ('sequential', 'load'):
+        for name, summary in results[mode].items():
+            before = baseline.get(mode, {}).get(name)
+            if not isinstance(summary, dict) or not before:
+                continue
+            if summary['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append('{0} {1}: p95 {2:.1f}ms -> {3:.1f}ms'
+                                   .format(mode, name, before['p95_ms'],
+                                           summary['p95_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--projects', type=int, default=5)
+    parser.add_argument('--pubs', type=int, default=20)
+    parser.add_argument('--apis', type=int, default=50)
+    parser.add_argument('--params', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=None,
+                        help='PASSWORD_ROUNDS, which dominates signin')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    config = {}
+    if args.rounds is not None:
+        config['PASSWORD_ROUNDS'] = args.rounds
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        app = create_bench_app(os.path.join(tmpdir, 'bench.db'),
+                               create_db=True, **config)
+        with app.app_context():
+            for i in range(args.projects):
+                seed_project('bench{0}'.format(i), pubs=max(args.pubs, 1),
+                             apis=max(args.apis, 1), params=args.params)
+            admin = User(email=_ADMIN['email'], name='Admin', is_admin=True)
+            admin.set_pwd(_ADMIN['pwd'])
+            admin.save()
+            routes = _routes(Interface.query.first().id,
+                             Publication.query.first().id)
+
+        results = {
+            'config': vars(args),
+            'sequential': _run_sequential(app, routes, args.requests),
+            'load': _run_load(app, routes, args.threads, args.seconds),
+            'peak_rss_kb': peak_rss_kb()
+        }
+        report(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = _regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+'''Measures /search query latency over the FTS5 index and the LIKE
+fallback, with synthetic projects seeded into a temporary database.
+'''
+
+from __future__ import division
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from apps import search
+from apps.models import db
+from . import create_bench_app, seed_project, report
+
+_QUERIES = ('concepts', 'param3', 'publication 7', 'api 42 term',
+            'proceedings benchmarks', 'nothingmatches')
+
+
+def _use_like_index(connection):
+    search.drop_index(connection)
+    search.search_index.create(bind=connection)
+    for _, Model, _, _, _ in search._KINDS:
+        search.index_items(Model, connection)
+
+
+def _time_queries(repeat):
+    timings = []
+    for query in _QUERIES:
+        for _ in range(repeat):
+            start = time.time()
+            search.search(query)
+            timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[int(len(timings) * 0.95)],
+        'max_ms': timings[-1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--projects', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        app = create_bench_app(os.path.join(tmpdir, 'bench.db'),
+                               create_db=True)
+        with app.test_request_context():
+            for i in range(args.projects):
+                seed_project('bench{0}'.format(i))
+
+            connection = db.session.connection()
+            results = {
+                'projects': args.projects,
+                'rows': db.session.execute(
+                    'SELECT count(*) FROM search_index').scalar()
+            }
+            results[search._index_type(connection)] = \
+                _time_queries(args.repeat)
+
+            _use_like_index(connection)
+            results['like'] = _time_queries(args.repeat)
+            db.session.rollback()
+        report(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''Measures how long a new worker process takes to serve its first
+requests, with templates compiled on first use and with them loaded from
+a bytecode cache filled by ``precompile_templates``.
+
+Each run starts a fresh interpreter that imports the app, creates it and
+requests a few routes once each. ``startup_ms`` is the time from starting
+the process to the end of its first response.
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from apps import precompile_templates
+from . import create_bench_app, seed_project, percentile, report
+
+_ROUTES = ('/', '/project/bench0', '/signin')
+
+# Run by each worker process, timing against the clock of the parent.
+_WORKER = '''
+import json, sys, time
+start = time.time()
+from apps import create_app
+imported = time.time()
+app = create_app(config=json.loads(sys.argv[1]), profile='production')
+created = time.time()
+client = app.test_client()
+responses = []
+for path in json.loads(sys.argv[2]):
+    request_start = time.time()
+    status = client.get(path, buffered=True).status_code
+    responses.append((path, status, request_start, time.time()))
+print(json.dumps({'start': start, 'imported': imported, 'created': created,
+                  'responses': responses}))
+'''
+
+
+def _run_worker(config):
+    spawned = time.time()
+    output = subprocess.check_output(
+        [sys.executable, '-c', _WORKER, json.dumps(config),
+         json.dumps(_ROUTES)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    times = json.loads(output.decode('utf-8').splitlines()[-1])
+
+    run = {
+        'startup_ms': (times['responses'][0][3] - spawned) * 1000,
+        'interpreter_ms': (times['start'] - spawned) * 1000,
+        'import_ms': (times['imported'] - times['start']) * 1000,
+        'create_app_ms': (times['created'] - times['imported']) * 1000
+    }
+    for path, status, start, end in times['responses']:
+        assert status == 200, (path, status)
+        run['first ' + path + ' ms'] = (end - start) * 1000
+    return run
+
+
+def _summarize(runs):
+    summary = {}
+    for name in runs[0]:
+        values = sorted(run[name] for run in runs)
+        summary[name] = {'p50': percentile(values, 50), 'max': values[-1]}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--apis', type=int, default=50)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmpdir, 'bench.db')
+        cache_dir = os.path.join(tmpdir, 'templates')
+        config = {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+            'PAGE_CACHE_TYPE': 'null',
+            'TEMPLATE_BYTECODE_CACHE_DIR': cache_dir
+        }
+
+        app = create_bench_app(db_path, create_db=True, **config)
+        with app.app_context():
+            seed_project('bench0', apis=args.apis)
+        precompile_templates(app)
+
+        modes = (('compile', dict(config, TEMPLATE_BYTECODE_CACHE=False)),
+                 ('bytecode_cache', config))
+        results = {'config': vars(args)}
+        for mode, mode_config in modes:
+            results[mode] = _summarize([_run_worker(mode_config)
+                                        for _ in range(args.runs)])
+        report(results)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+'''Reads project JSON while other processes save publications through
+edit_item, once with the development profile (rollback journal) and once
+with the production profile (WAL and the other SQLite PRAGMAs).
+
+Readers and writers run in separate processes, like workers of a
+deployment, so they contend on the database file rather than on the GIL.
+'''
+
+from __future__ import division
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import Event, Process, Queue
+
+from apps.models import User, Publication
+from . import create_bench_app, seed_project, percentile, report
+
+
+def _create_app(db_path, profile, create_db=False):
+    return create_bench_app(db_path, create_db=create_db, profile=profile,
+                            PASSWORD_ROUNDS=1000)
+
+
+def _reader(db_path, profile, stop, results):
+    client = _create_app(db_path, profile).test_client()
+    latencies, errors = [], 0
+    while not stop.is_set():
+        start = time.time()
+        try:
+            response = client.get('/api/project/bench')
+            assert response.status_code == 200, response.status_code
+        except Exception:
+            errors += 1
+        else:
+            latencies.append(time.time() - start)
+    results.put(('read', latencies, errors))
+
+
+def _writer(db_path, profile, pub_id, stop, results):
+    client = _create_app(db_path, profile).test_client()
+    client.post('/signin', data={'email': 'admin@example.com',
+                                 'pwd': 'admin'})
+    writes, errors = 0, 0
+    while not stop.is_set():
+        try:
+            response = client.post(
+                '/project/bench/edit/pub?id={0}'.format(pub_id),
+                data={'title': 'Publication {0}'.format(writes),
+                      'authors': 'A. Author', 'publisher': 'Benchmarks',
+                      'date': '2014-01-01'})
+            assert response.status_code == 302, response.status_code
+        except Exception:
+            errors += 1
+        else:
+            writes += 1
+    results.put(('write', writes, errors))
+
+
+def _run_profile(profile, args):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmpdir, 'bench.db')
+        app = _create_app(db_path, profile, create_db=True)
+        with app.app_context():
+            seed_project('bench', pubs=args.writers, apis=args.apis)
+            admin = User(email='admin@example.com', name='Admin',
+                         is_admin=True)
+            admin.set_pwd('admin')
+            admin.save()
+            pub_ids = [pub.id for pub in Publication.query]
+
+        stop = Event()
+        results = Queue()
+        processes = [Process(target=_reader,
+                             args=(db_path, profile, stop, results))
+                     for _ in range(args.readers)]
+        processes += [Process(target=_writer,
+                              args=(db_path, profile, pub_id, stop, results))
+                      for pub_id in pub_ids]
+        for process in processes:
+            process.start()
+        time.sleep(args.seconds)
+        stop.set()
+
+        latencies, read_errors, writes, write_errors = [], 0, 0, 0
+        for _ in processes:
+            kind, value, errors = results.get()
+            if kind == 'read':
+                latencies.extend(value)
+                read_errors += errors
+            else:
+                writes += value
+                write_errors += errors
+        for process in processes:
+            process.join()
+
+        return {
+            'reads_per_second': len(latencies) / args.seconds,
+            'read_ms_p50': percentile(latencies, 50) * 1000,
+            'read_ms_p95': percentile(latencies, 95) * 1000,
+            'read_ms_max': max(latencies) * 1000,
+            'read_errors': read_errors,
+            'writes_per_second': writes / args.seconds,
+            'write_errors': write_errors
+        }
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--apis', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    report(dict((profile, _run_profile(profile, args))
+                for profile in ('development', 'production')))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,139 @@
 # -*- coding: utf-8 -*-
 
-DEBUG = True
-SECRET_KEY = 'SECRET_KEY'
+import os
 
-WTF_CSRF_SECRET_KEY = 'WTF_CSRF_SECRET_KEY'
 
-SQLALCHEMY_DATABASE_URI = 'sqlite:///project.db'
-SQLALCHEMY_ECHO = True
+class Config(object):
+    DEBUG = False
+    SECRET_KEY = 'SECRET_KEY'
+
+    WTF_CSRF_SECRET_KEY = 'WTF_CSRF_SECRET_KEY'
+
+    # New hashes use the first scheme; others are rehashed on sign-in, as
+    # are hashes with fewer rounds.
+    PASSWORD_SCHEMES = ['sha256_crypt']
+    PASSWORD_ROUNDS = 110000
+    # Verify passwords in a pool of this many threads (0 verifies inline).
+    PASSWORD_VERIFY_THREADS = 0
+
+    # Seconds a signed-in user's details and permissions are cached per
+    # worker, for at most USER_CACHE_SIZE users.
+    USER_CACHE_TTL = 10
+    USER_CACHE_SIZE = 10000
+
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///project.db'
+    SQLALCHEMY_ECHO = False
+    # PRAGMAs run on every new SQLite connection.
+    SQLITE_PRAGMAS = {}
+
+    # 'memory', 'file' or 'null'
+    PAGE_CACHE_TYPE = 'memory'
+    PAGE_CACHE_DIR = None
+    PAGE_CACHE_SIZE = 16 * 1024 * 1024
+
+    # Same choices, for sections of pages cached with {% cache %}.
+    FRAGMENT_CACHE_TYPE = 'memory'
+    FRAGMENT_CACHE_DIR = None
+    FRAGMENT_CACHE_SIZE = 16 * 1024 * 1024
+
+    # max-age sent with the ETag of public pages and the JSON API.
+    HTTP_CACHE_MAX_AGE = 0
+
+    # Seconds a worker trusts its navigation bar without checking for
+    # changes.
+    NAV_CACHE_TTL = 10
+
+    # Rows per page of the admin listings, and the most a ``per_page``
+    # argument may ask for.
+    LIST_PAGE_SIZE = 50
+    LIST_MAX_PAGE_SIZE = 500
+
+    # Serve the fingerprinted static files built by ``manage.py assets``,
+    # when there are any.
+    STATIC_ASSETS = True
+    # Pages load the copy of jQuery vendored as static/js/jquery.min.js,
+    # and this one of the same version if there is none or it fails to
+    # load.
+    JQUERY_URL = ('https://ajax.googleapis.com/ajax/libs/jquery/1.11.0/'
+                  'jquery.min.js')
+
+    # ``manage.py freeze`` writes the public pages and static files here
+    # for the web server to serve; None uses a folder in the instance
+    # folder. With FREEZE_ON_COMMIT, projects changed by a commit are
+    # frozen again in a background thread.
+    FREEZE_DIR = None
+    FREEZE_ON_COMMIT = False
+
+    # Render Markdown, update the search index and freeze pages in jobs run
+    # after the commit by ``manage.py worker``, or by JOBS_THREADS threads
+    # of each app process, started on its first request. Failed jobs are
+    # retried after JOBS_RETRY_DELAY seconds, doubled after every attempt.
+    JOBS_ENABLED = False
+    JOBS_THREADS = 0
+    JOBS_MAX_ATTEMPTS = 5
+    JOBS_RETRY_DELAY = 2
+    # Seconds idle workers wait between looks for jobs queued by other
+    # processes, and a claimed job is left to its worker.
+    JOBS_POLL_INTERVAL = 1
+    JOBS_LEASE = 300
+
+    # Link downloads copied by ``manage.py mirror-downloads`` to
+    # /download/<id>, which serves them from DOWNLOAD_MIRROR_DIR (None uses
+    # a folder in the instance folder). Set DOWNLOAD_SENDFILE to
+    # 'x-sendfile' or 'x-accel-redirect' to leave sending them to the web
+    # server; nginx finds them under DOWNLOAD_ACCEL_PREFIX.
+    DOWNLOAD_MIRROR = False
+    DOWNLOAD_MIRROR_DIR = None
+    DOWNLOAD_SENDFILE = None
+    DOWNLOAD_ACCEL_PREFIX = '/_mirror/'
+
+    # Compress HTML and JSON responses for clients accepting it, with
+    # Brotli if the ``brotli`` module is installed and gzip otherwise.
+    # Bodies shorter than COMPRESS_MIN_SIZE bytes are sent as they are;
+    # streamed pages are always compressed. ``python -m
+    # benchmarks.compression`` compares levels.
+    COMPRESS = True
+    COMPRESS_LEVEL = 6
+    COMPRESS_BR_QUALITY = 5
+    COMPRESS_MIN_SIZE = 512
+
+    # Time requests by endpoint, adding a Server-Timing header and serving
+    # histograms at /metrics.
+    METRICS_ENABLED = False
+
+    # Keep compiled templates in files shared by all workers, filled by
+    # ``manage.py precompile``. The folder defaults to one in the instance
+    # folder.
+    TEMPLATE_BYTECODE_CACHE = True
+    TEMPLATE_BYTECODE_CACHE_DIR = None
+
+    # Stream minified pages without flashed messages or forms to the client.
+    STREAM_TEMPLATES = True
+    STREAM_CHUNK_SIZE = 8192
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    SQLALCHEMY_ECHO = True
+
+
+class ProductionConfig(Config):
+    # Sign sessions and CSRF tokens; the app refuses to start without them.
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    WTF_CSRF_SECRET_KEY = os.environ.get('WTF_CSRF_SECRET_KEY')
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+                                             Config.SQLALCHEMY_DATABASE_URI)
+
+    # WAL lets readers go on while a writer commits.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024
+    }
+
+    # Only used by server databases such as PostgreSQL.
+    SQLALCHEMY_POOL_SIZE = 10
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 3600
@@ -1,16 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from __future__ import print_function
+from __future__ import division, print_function
 
-from flask.ext.script import Manager, prompt, prompt_bool, prompt_pass
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import urllib2
+from datetime import datetime
+
+from flask import current_app
+from flask.ext.script import (Manager, Command, Option, prompt, prompt_bool,
+                              prompt_pass)
+from sqlalchemy import bindparam, event, func, inspect, select
 from werkzeug.datastructures import MultiDict
 
-from apps import create_app
-from apps.models import db, User
+from apps import create_app, precompile_templates
+from apps.models import (db, User, Publication, Application, Interface,
+                         Parameter, Download, Project, project_managers,
+                         bump_cache_version)
+from apps.assets import build_assets
+from apps.freeze import freeze as freeze_site, freezer
+from apps.jobs import job_queue
+from apps.mirror import mirror
 from apps.forms import SignupForm
+from apps.search import index_items, reindex as reindex_search
 
 manager = Manager(create_app)
+manager.add_option('--profile', dest='profile', required=False)
 
 
 @manager.command
@@ -51,5 +72,484 @@ def createuser():
                 print('[Error] {0}: {1}'.format(field_text, error))
 
 
+def _add_missing_columns(table):
+    existing = set(column['name'] for column in
+                   inspect(db.engine).get_columns(table.name))
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.engine.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                table.name, column.name, column_type))
+
+
+def _create_missing_indexes(table):
+    existing = set(index['name'] for index in
+                   inspect(db.engine).get_indexes(table.name))
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(db.engine)
+
+
+def _remove_duplicate_managers():
+    pm = project_managers
+    duplicates = db.session.execute(
+        select([pm.c.project_id, pm.c.user_id])
+        .group_by(pm.c.project_id, pm.c.user_id)
+        .having(func.count() > 1)).fetchall()
+    for project_id, user_id in duplicates:
+        db.session.execute(pm.delete().where(
+            (pm.c.project_id == project_id) & (pm.c.user_id == user_id)))
+        db.session.execute(pm.insert().values(project_id=project_id,
+                                              user_id=user_id))
+    db.session.commit()
+
+
+@manager.command
+def upgradedb():
+    '''Adds missing tables, columns and indexes to an existing database.'''
+    db.create_all()
+    _remove_duplicate_managers()
+    for table in db.metadata.sorted_tables:
+        _add_missing_columns(table)
+        _create_missing_indexes(table)
+
+
+def _render_markdown_rows(Model, batch_size):
+    table = Model.__table__
+    fields = Model.__markdown__
+    columns = [table.c.id] + [table.c[field] for field in fields]
+    update = table.update().where(table.c.id == bindparam('_id'))
+
+    count = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(columns).where(table.c.id > last_id)
+            .order_by(table.c.id).limit(batch_size)).fetchall()
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            values = Model.markdown_columns(row)
+            values['_id'] = row.id
+            params.append(values)
+
+        db.session.execute(update, params)
+        db.session.commit()
+        count += len(rows)
+        last_id = rows[-1].id
+
+    return count
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=500)
+def rendermarkdown(batch_size):
+    '''Renders Markdown columns of existing rows into their HTML columns.'''
+    for Model in (Project, Interface, Parameter):
+        _add_missing_columns(Model.__table__)
+        count = _render_markdown_rows(Model, batch_size)
+        print('{0}: {1} rows rendered.'.format(Model.__caption__, count))
+
+
+@manager.command
+def reindex():
+    '''Rebuilds the full-text search index from scratch.'''
+    start = time.time()
+    reindex_search(db.session.connection())
+    db.session.commit()
+    print('Search index rebuilt in {0:.1f}s.'.format(time.time() - start))
+
+
+@manager.option('--clean', dest='clean', action='store_true', default=False,
+                help='Remove files of earlier builds')
+def assets(clean):
+    '''Builds fingerprinted, precompressed static files.'''
+    totals = build_assets(current_app.static_folder, clean)
+    print('{files} files, {bytes} bytes ({gzip_bytes} gzipped, {br_bytes} '
+          'with Brotli where available).'.format(**totals))
+    print('Restart the server to use them.')
+
+
+@manager.command
+def precompile():
+    '''Compiles the templates into the bytecode cache shared by workers.'''
+    if current_app.jinja_env.bytecode_cache is None:
+        print('TEMPLATE_BYTECODE_CACHE is off.', file=sys.stderr)
+        return
+
+    start = time.time()
+    names = precompile_templates(current_app)
+    print('{0} templates compiled in {1:.2f}s.'.format(
+        len(names), time.time() - start))
+
+
+@manager.option('-o', '--output', dest='output', default=None,
+                help='Defaults to FREEZE_DIR')
+@manager.option('-p', '--processes', dest='processes', type=int,
+                default=None, help='Defaults to one per CPU')
+@manager.option('--force', dest='force', action='store_true', default=False,
+                help='Render every page again')
+def freeze(output, processes, force):
+    '''Renders the public pages into static files for the web server.'''
+    output = output or freezer.output
+    start = time.time()
+    counts = freeze_site(current_app._get_current_object(), output,
+                         processes, force)
+    print('{projects} projects rendered, {removed} removed, {static_files} '
+          'static files copied'.format(**counts), end=' ')
+    print('to {0} in {1:.1f}s.'.format(output, time.time() - start))
+
+
+@manager.option('-t', '--threads', dest='threads', type=int, default=2)
+@manager.option('-i', '--interval', dest='interval', type=int, default=60,
+                help='Seconds between printed stats')
+def worker(threads, interval):
+    '''Runs queued jobs until interrupted.'''
+    if not job_queue.enabled:
+        print('JOBS_ENABLED is off.', file=sys.stderr)
+        return
+
+    job_queue.start(current_app._get_current_object(), threads)
+    try:
+        while True:
+            time.sleep(interval)
+            print(json.dumps(job_queue.stats(), sort_keys=True))
+            db.session.remove()
+    except KeyboardInterrupt:
+        job_queue.stop()
+
+
+# "SCAN TABLE project" before SQLite 3.36, "SCAN project" since.
+_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+
+
+def _explain_routes(project, ids):
+    '''Returns ``(path, user)`` tuples; ``user`` signs in first.'''
+    routes = [('/', None),
+              ('/project/' + project, None),
+              ('/api/project/' + project, None),
+              ('/search?q=concepts', None),
+              ('/download/{0}'.format(ids['download']), None),
+              ('/project/' + project, 'manager'),
+              ('/project/{0}/edit'.format(project), 'manager'),
+              ('/project/{0}/delete/api?id={1}'.format(project, ids['api']),
+               'manager'),
+              ('/projects', 'admin'),
+              ('/users', 'admin'),
+              ('/user/{0}/edit'.format(ids['manager']), 'admin')]
+    for item_type in ('pub', 'app', 'api', 'param', 'download'):
+        routes.append(('/project/{0}/edit/{1}?id={2}'.format(
+            project, item_type, ids[item_type]), 'manager'))
+    return routes
+
+
+def _seed_explain_db(projects):
+    from benchmarks import seed_project
+
+    for i in range(projects):
+        seed_project('explain{0}'.format(i), pubs=3, apis=3, params=3)
+    for name, is_admin in (('admin', True), ('manager', False)):
+        user = User(email='{0}@example.com'.format(name), name=name,
+                    is_admin=is_admin)
+        user.set_pwd(name)
+        user.save()
+
+    # The routes look at a project in the middle of the table.
+    project = Project.query.filter_by(
+        short_name='explain{0}'.format(projects // 2)).one()
+    manager = User.query.filter_by(name='manager').one()
+    project.managers.append(manager)
+    project.save()
+    Application.create(name='Explorer', url='http://example.com/',
+                       img_url='http://example.com/explorer.png',
+                       desc='Browses the data.', project_id=project.id)
+
+    api = Interface.query.filter_by(project_id=project.id).first()
+    ids = {'manager': manager.id, 'api': api.id,
+           'param': Parameter.query.filter_by(api_id=api.id).first().id}
+    for item_type, Model in (('pub', Publication), ('app', Application),
+                             ('download', Download)):
+        ids[item_type] = Model.query.filter_by(
+            project_id=project.id).first().id
+    return project.short_name, ids
+
+
+def _capture_statements(app, routes):
+    # (path, statement, parameters) of the statements each route ran,
+    # leaving out those signing in.
+    statements = []
+    current = [None]
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if current[0] is not None and not executemany:
+            statements.append((current[0], statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        for path, user in routes:
+            client = app.test_client()
+            if user is not None:
+                client.post('/signin', data={
+                    'email': '{0}@example.com'.format(user), 'pwd': user})
+            current[0] = path
+            response = client.get(path, buffered=True)
+            current[0] = None
+            if response.status_code not in (200, 302):
+                raise RuntimeError('{0} returned {1}'.format(
+                    path, response.status_code))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    return statements
+
+
+def _full_scans(cursor, statement, parameters):
+    # Statements without WHERE or JOIN want every row, e.g. to list all
+    # projects in the navigation bar, so only their scans are excused.
+    whole_table = not re.search(r'\b(WHERE|JOIN)\b', statement)
+    scans = []
+    for row in cursor.execute('EXPLAIN QUERY PLAN ' + statement,
+                              parameters):
+        match = _SCAN_PATTERN.match(row[-1])
+        if match is not None and match.group(1) in db.metadata.tables and \
+           'USING' not in match.group(2):
+            scans.append((match.group(1), whole_table))
+    return scans
+
+
+@manager.option('-p', '--projects', dest='projects', type=int, default=20,
+                help='Projects to seed')
+def explain(projects):
+    '''Fails if a route's SQL scans a whole table to find some rows.'''
+    from benchmarks import create_bench_app
+
+    failed = False
+    tmpdir = tempfile.mkdtemp()
+    try:
+        app = create_bench_app(
+            os.path.join(tmpdir, 'explain.db'), create_db=True,
+            FRAGMENT_CACHE_TYPE='null', JOBS_ENABLED=False,
+            FREEZE_ON_COMMIT=False, METRICS_ENABLED=False)
+        with app.app_context():
+            project, ids = _seed_explain_db(projects)
+            routes = _explain_routes(project, ids)
+            statements = _capture_statements(app, routes)
+
+            connection = db.engine.raw_connection()
+            cursor = connection.cursor()
+            seen = set()
+            for path, statement, parameters in statements:
+                if statement in seen:
+                    continue
+                seen.add(statement)
+                for table, whole_table in _full_scans(cursor, statement,
+                                                      parameters):
+                    failed = failed or not whole_table
+                    print('[{0}] {1}: full scan of {2}\n    {3}'.format(
+                        'Ok' if whole_table else 'Error', path, table,
+                        ' '.join(statement.split())))
+            connection.close()
+            print('{0} statements of {1} routes explained.'.format(
+                len(seen), len(routes)))
+    finally:
+        shutil.rmtree(tmpdir)
+    if failed:
+        sys.exit(1)
+
+
+# Parents come before their children, so an import can insert them in order.
+_EXPORTED_MODELS = (Project, Publication, Application, Download, Interface,
+                    Parameter)
+
+
+class _Progress(object):
+
+    def __init__(self, every):
+        self.every = every
+        self.count = 0
+        self.start = time.time()
+
+    def add(self, count=1):
+        for _ in range(count):
+            self.count += 1
+            if self.count % self.every == 0:
+                self.report()
+
+    def report(self):
+        elapsed = time.time() - self.start
+        print('{0} rows in {1:.1f}s ({2:.0f} rows/s)'.format(
+            self.count, elapsed, self.count / elapsed if elapsed else 0),
+            file=sys.stderr)
+
+
+@manager.option('-o', '--output', dest='output', default='-')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=1000)
+def export(output, batch_size):
+    '''Exports all projects and their items as newline-delimited JSON.'''
+    f = sys.stdout if output == '-' else open(output, 'w')
+    progress = _Progress(batch_size * 10)
+    try:
+        for Model in _EXPORTED_MODELS:
+            for item in Model.query.order_by(Model.id).yield_per(batch_size):
+                record = {'table': Model.__tablename__, 'row': item.to_dict()}
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+                progress.add()
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    progress.report()
+
+
+def _parse_value(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, db.DateTime):
+        fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+        return datetime.strptime(value, fmt)
+    if isinstance(column.type, db.Date):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def _max_id(table):
+    return db.session.execute(select([func.max(table.c.id)])).scalar() or 0
+
+
+def _import(input, batch_size):
+    models = dict((Model.__tablename__, Model) for Model in _EXPORTED_MODELS)
+
+    # Imported ids are shifted past the existing ones, so an import never
+    # clashes with rows already in the database.
+    offsets = dict((name, _max_id(Model.__table__))
+                   for name, Model in models.items())
+
+    f = sys.stdin if input == '-' else open(input)
+    progress = _Progress(batch_size * 10)
+    pending_table = None
+    pending = []
+    try:
+        for line in f:
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            Model = models[record['table']]
+            table = Model.__table__
+            if table is not pending_table or len(pending) >= batch_size:
+                if pending:
+                    db.session.execute(pending_table.insert(), pending)
+                    progress.add(len(pending))
+                pending_table = table
+                pending = []
+
+            row = dict((column.name,
+                        _parse_value(column, record['row'].get(column.name)))
+                       for column in Model.data_columns())
+            row['id'] += offsets[record['table']]
+            for column in Model.data_columns():
+                for fk in column.foreign_keys:
+                    if row[column.name] is not None:
+                        row[column.name] += offsets[fk.column.table.name]
+            row.update(Model.markdown_columns(row))
+            pending.append(row)
+
+        if pending:
+            db.session.execute(pending_table.insert(), pending)
+            progress.add(len(pending))
+
+        connection = db.session.connection()
+        for name, Model in models.items():
+            index_items(Model, connection,
+                        Model.__table__.c.id > offsets[name])
+        bump_cache_version('nav')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    progress.report()
+
+
+class _ImportCommand(Command):
+    '''Imports projects written by the export command in one transaction.'''
+
+    option_list = (
+        Option('-i', '--input', dest='input', default='-'),
+        Option('-b', '--batch-size', dest='batch_size', type=int,
+               default=1000)
+    )
+
+    def run(self, input, batch_size):
+        _import(input, batch_size)
+
+
+manager.add_command('import', _ImportCommand())
+
+
+def _mirror_download(download, filename, sha256):
+    if filename is not None:
+        with open(filename, 'rb') as f:
+            sha256, size = mirror.store(f, sha256)
+    else:
+        sha256, size = mirror.fetch(download.url, sha256)
+    download.update(sha256=sha256, size=size)
+    return size
+
+
+class _MirrorDownloadsCommand(Command):
+    '''Copies downloads into the local mirror, checking their SHA-256.'''
+
+    option_list = (
+        Option('-i', '--id', dest='download_id', type=int, default=None,
+               help='Only this download'),
+        Option('-f', '--file', dest='filename', default=None,
+               help='Copy this file instead of fetching the URL; needs '
+                    '--id'),
+        Option('--sha256', dest='sha256', default=None,
+               help='Expected SHA-256; needs --id'),
+        Option('--force', dest='force', action='store_true', default=False,
+               help='Fetch mirrored downloads again'),
+        Option('--prune', dest='prune', action='store_true', default=False,
+               help='Remove files no download refers to')
+    )
+
+    def run(self, download_id, filename, sha256, force, prune):
+        if (filename or sha256) and download_id is None:
+            print('--file and --sha256 need --id.', file=sys.stderr)
+            return
+
+        query = Download.query.order_by(Download.id)
+        if download_id is not None:
+            query = query.filter_by(id=download_id)
+
+        start = time.time()
+        count = total = 0
+        for download in query.all():
+            if not force and filename is None and mirror.has(download.sha256):
+                continue
+            try:
+                total += _mirror_download(download, filename, sha256)
+            except (IOError, ValueError, urllib2.URLError) as e:
+                print('[Error] {0}: {1}'.format(download.url, e),
+                      file=sys.stderr)
+                continue
+            count += 1
+        print('{0} downloads, {1} bytes mirrored in {2:.1f}s.'.format(
+            count, total, time.time() - start))
+
+        if prune:
+            keep = set(row.sha256 for row in Download.query
+                       .with_entities(Download.sha256)
+                       .filter(Download.sha256.isnot(None)))
+            print('{0} files removed.'.format(mirror.prune(keep)))
+
+
+manager.add_command('mirror-downloads', _MirrorDownloadsCommand())
+
+
 if __name__ == '__main__':
     manager.run()
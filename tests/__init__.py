@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+'''Tests for the site, run from the repository root as
+``python -m unittest discover tests``.
+'''
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+from werkzeug.http import http_date
+
+from apps.mirror import DownloadMirror
+
+_CONTENT = b'0123456789' * 100
+
+_SHA256 = hashlib.sha256(_CONTENT).hexdigest()
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.mirror = DownloadMirror()
+        self.mirror.folder = self.folder
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _files(self):
+        return [os.path.relpath(os.path.join(root, name), self.folder)
+                for root, dirs, files in os.walk(self.folder)
+                for name in files]
+
+    def test_store(self):
+        self.assertEqual(self.mirror.store(io.BytesIO(_CONTENT)),
+                         (_SHA256, len(_CONTENT)))
+        # Storing it again keeps the one copy.
+        self.mirror.store(io.BytesIO(_CONTENT), _SHA256.upper())
+        self.assertEqual(self._files(),
+                         [os.path.join(_SHA256[:2], _SHA256[2:])])
+        with io.open(self.mirror.path(_SHA256), 'rb') as f:
+            self.assertEqual(f.read(), _CONTENT)
+
+    def test_store_checks_sha256(self):
+        self.assertRaises(ValueError, self.mirror.store,
+                          io.BytesIO(_CONTENT), '0' * 64)
+        self.assertEqual(self._files(), [])
+
+
+class SendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        app = Flask(__name__)
+        app.config['DOWNLOAD_MIRROR_DIR'] = self.folder
+        self.mirror = DownloadMirror(app)
+        self.mirror.store(io.BytesIO(_CONTENT))
+        app.add_url_rule('/download', 'download', lambda: self.mirror.send(
+            _SHA256, 'http://example.com/files/dump.tar.gz'))
+        self.client = app.test_client()
+        self.last_modified = http_date(
+            int(os.stat(self.mirror.path(_SHA256)).st_mtime))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _get(self, **headers):
+        return self.client.get('/download', headers=headers, buffered=True)
+
+    def test_whole_file(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, _CONTENT)
+        self.assertEqual(response.headers['ETag'], '"{0}"'.format(_SHA256))
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'attachment; filename=dump.tar.gz')
+
+    def test_not_modified(self):
+        response = self._get(If_None_Match='"{0}"'.format(_SHA256))
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        response = self._get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, _CONTENT[10:20])
+        self.assertEqual(response.headers['Content-Range'],
+                         'bytes 10-19/{0}'.format(len(_CONTENT)))
+        self.assertEqual(response.headers['Content-Length'], '10')
+
+    def test_unsatisfiable_range(self):
+        response = self._get(Range='bytes={0}-'.format(len(_CONTENT)))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'],
+                         'bytes */{0}'.format(len(_CONTENT)))
+
+    def test_if_range_etag(self):
+        response = self._get(Range='bytes=10-19',
+                             If_Range='"{0}"'.format(_SHA256))
+        self.assertEqual(response.status_code, 206)
+        # A weak or different ETag gets the whole file.
+        for etag in ('W/"{0}"'.format(_SHA256), '"other"'):
+            response = self._get(Range='bytes=10-19', If_Range=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, _CONTENT)
+
+    def test_if_range_date(self):
+        response = self._get(Range='bytes=10-19',
+                             If_Range=self.last_modified)
+        self.assertEqual(response.status_code, 206)
+        # Only the exact Last-Modified date matches.
+        response = self._get(Range='bytes=10-19',
+                             If_Range=http_date(2 ** 31))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, _CONTENT)
+
+
+if __name__ == '__main__':
+    unittest.main()
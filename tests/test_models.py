@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from apps.models import db, QueryCounter, Download, Project
+from benchmarks import create_bench_app, seed_project
+
+
+class GraphQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.app = create_bench_app(os.path.join(self.tmpdir, 'test.db'),
+                                    create_db=True)
+        self.context = self.app.app_context()
+        self.context.push()
+        seed_project('small', pubs=1, apis=1, params=1, downloads=1)
+        seed_project('large', pubs=20, apis=30, params=8, downloads=5)
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.tmpdir)
+
+    def _count_queries(self, short_name):
+        with QueryCounter() as counter:
+            project = Project.graph_query() \
+                .filter_by(short_name=short_name).one()
+            # Walking the whole graph must not load anything lazily.
+            items = list(project.pubs) + list(project.apps) + \
+                list(project.downloads) + list(project.managers)
+            for api in project.apis:
+                items.extend(api.params)
+        db.session.remove()
+        return counter.count, len(items)
+
+    def test_query_count_is_independent_of_item_count(self):
+        small_count, small_items = self._count_queries('small')
+        large_count, large_items = self._count_queries('large')
+        self.assertGreater(large_items, small_items)
+        self.assertEqual(small_count, large_count)
+
+
+class DownloadBulkUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.app = create_bench_app(os.path.join(self.tmpdir, 'test.db'),
+                                    create_db=True)
+        self.context = self.app.app_context()
+        self.context.push()
+        seed_project('p', pubs=0, apis=0, params=0, downloads=2)
+        Download.bulk_update([{'id': 1, 'sha256': 'a' * 64, 'size': 1},
+                              {'id': 2, 'sha256': 'b' * 64, 'size': 2}])
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_new_url_forgets_mirrored_copy(self):
+        Download.bulk_update([{'id': 1, 'url': 'http://example.com/new'},
+                              {'id': 2, 'name': 'Renamed'}])
+        db.session.remove()
+        self.assertEqual([(d.sha256, d.size) for d in
+                          Download.query.order_by(Download.id)],
+                         [(None, None), ('b' * 64, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()